@@ -0,0 +1,149 @@
+'''
+Measures how the server admits new connections under bad behaviour and
+overload.
+
+stall: clients join while other connections are open but never join.
+    Reports the join latency, a join is a connect, join and list round trip.
+storm: many connections join at once. Reports how many were answered
+    with each outcome and how long it took until all were answered.
+timeout: how long a connection that never joins stays open.
+
+Runs against the current server, and against any other server
+implementation passed with --server to compare.
+'''
+import asyncio
+import getopt
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from workload import free_port, start_server  # noqa: E402
+from client import AsyncClient  # noqa: E402
+
+
+async def join_latency(port, username) -> float:
+    '''
+    Seconds from connecting to the answer of a list request
+    '''
+    start = time.monotonic()
+    user = AsyncClient(username, "localhost", port)
+    await user.connect()
+    await user.join()
+    await user.list_users()
+    elapsed = time.monotonic() - start
+    await user.close()
+
+    return elapsed
+
+
+async def stall(port, idle, clients, hold):
+    '''
+    Join latencies of clients joining one after another while idle
+    connections that never join are held open for hold seconds
+    '''
+    idlers = [socket.create_connection(("localhost", port)) for _ in range(idle)]
+    loop = asyncio.get_running_loop()
+    loop.call_later(hold, lambda: [sock.close() for sock in idlers])
+
+    latencies = []
+    for i in range(clients):
+        latencies.append(await join_latency(port, f"user{i}"))
+
+    return latencies
+
+
+async def storm(port, count):
+    '''
+    Outcome counts of count connections joining at once, and the seconds
+    until every one of them was answered
+    '''
+    outcomes = {}
+
+    async def join(i):
+        user = AsyncClient(f"storm{i}", "localhost", port)
+
+        try:
+            await user.connect()
+            await user.join()
+            event = await asyncio.wait_for(anext(user.events(), None), 0.5)
+        except asyncio.TimeoutError:
+            event = None
+        except OSError:
+            event = "refused"
+
+        # no event within the timeout means the join went through
+        outcome = "joined" if event is None else getattr(event, "data", event)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        return user
+
+    start = time.monotonic()
+    users = await asyncio.gather(*(join(i) for i in range(count)))
+    elapsed = time.monotonic() - start - 0.5
+
+    for user in users:
+        await user.close()
+
+    return outcomes, elapsed
+
+
+def join_timeout(port) -> float:
+    '''
+    Seconds until the server closes a connection that never joins
+    '''
+    sock = socket.create_connection(("localhost", port))
+    start = time.monotonic()
+    sock.settimeout(30)
+
+    try:
+        sock.recv(1)
+    except (socket.timeout, OSError):
+        pass
+
+    sock.close()
+
+    return time.monotonic() - start
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "i:n:s:", ["idle=", "storm=", "server="])
+    except getopt.GetoptError:
+        print("-i COUNT | --idle=COUNT Connections that never join, defaults to 5")
+        print("-n COUNT | --storm=COUNT Connections joining at once, defaults to 300")
+        print("-s FILE | --server=FILE Another server implementation to compare against")
+        sys.exit(1)
+
+    IDLE = 5
+    STORM = 300
+    SERVERS = ["server.py"]
+    for o, a in OPTS:
+        if o in ("-i", "--idle"):
+            IDLE = int(a)
+        elif o in ("-n", "--storm"):
+            STORM = int(a)
+        elif o in ("-s", "--server"):
+            SERVERS.append(a)
+
+    for SERVER in SERVERS:
+        PORT = free_port()
+        # other implementations may not know the option
+        OPTIONS = ["--join-timeout=1"] if SERVER == "server.py" else []
+        PROCESS = start_server(PORT, *OPTIONS, server=SERVER)
+
+        LATENCIES = sorted(asyncio.run(stall(PORT, IDLE, 5, 2)))
+        print(f"{SERVER} stall: {IDLE} idle connections, join latency "
+              f"min {LATENCIES[0] * 1000:.1f} ms, max {LATENCIES[-1] * 1000:.1f} ms")
+
+        OUTCOMES, ELAPSED = asyncio.run(storm(PORT, STORM))
+        print(f"{SERVER} storm: {STORM} joins answered in {ELAPSED:.2f} s, "
+              + ", ".join(f"{count} {outcome}" for outcome, count in sorted(OUTCOMES.items())))
+
+        if SERVER == "server.py":
+            print(f"{SERVER} timeout: idle connection closed after {join_timeout(PORT):.2f} s")
+
+        PROCESS.kill()
+        PROCESS.wait()
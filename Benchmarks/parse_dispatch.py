@@ -0,0 +1,92 @@
+'''
+Microbenchmark of the server's parse + dispatch cost per message size.
+
+Compares the command table and Session field parser with the previous
+decode().split(" ") / " ".join() handling of a send_message, with the
+recipient's send stubbed out so only parsing and dispatch are timed.
+'''
+import contextlib
+import getopt
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import util  # noqa: E402
+from server import Server, Session  # noqa: E402
+
+
+class NullSession:
+    '''
+    Recipient that drops everything sent to it
+    '''
+
+    def send_frame(self, *parts):
+        '''
+        Discards the message
+        '''
+
+
+def legacy_dispatch(data, sender_username, client_list):
+    '''
+    The previous hot path: split the whole message, rejoin the payload
+    '''
+    recv_str = data.decode().split(" ")
+    msg_type = recv_str[0].split("_")[-1]
+    num_of_users = int(recv_str[1])
+    usernames = list(set(recv_str[2:2+num_of_users]))
+    message = " ".join(recv_str[2+num_of_users:])
+
+    print(f"msg: {sender_username}")
+
+    for username in usernames:
+        _conn = client_list.get(username)
+        if _conn:
+            send_str = util.make_message(
+                f"forward_{msg_type}", 4, sender_username + " " + message)
+            _conn.send_frame(send_str.encode("utf-8"))
+
+
+def table_dispatch(server, session, size):
+    '''
+    The current hot path: parse the command, look up its handler
+    '''
+    session.recv_pos = 0
+    session.recv_size = size
+    server.commands[session.next_field()](session, "sender")
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "n:", ["number="])
+    except getopt.GetoptError:
+        print("-n COUNT | --number=COUNT Repetitions per size, defaults to 200")
+        sys.exit(1)
+
+    NUMBER = 200
+    for o, a in OPTS:
+        if o in ("-n", "--number"):
+            NUMBER = int(a)
+
+    SERVER = Server("localhost", 0)
+    SERVER.client_list = {"client1": NullSession(), "client2": NullSession()}
+    SESSION = Session(None, "sender")
+
+    print(f"{'payload bytes':>14} {'split+join us':>14} {'table us':>10} {'speedup':>8}")
+
+    for payload_size in [16, 1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024]:
+        words = ("word " * (payload_size // 5 + 1))[:payload_size]
+        data = f"send_message 2 client1 client2 {words}".encode("utf-8")
+        SESSION.recv_buf = bytearray(data)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            number = NUMBER if payload_size < 1024 * 1024 else 5
+            legacy = timeit.timeit(lambda: legacy_dispatch(
+                data, "sender", SERVER.client_list), number=number) / number
+            table = timeit.timeit(lambda: table_dispatch(
+                SERVER, SESSION, len(data)), number=number) / number
+
+        print(f"{payload_size:>14} {legacy * 1e6:>14.1f} {table * 1e6:>10.1f} "
+              f"{legacy / table:>7.1f}x")
@@ -0,0 +1,71 @@
+'''
+Profiles the server under the benchmark workload.
+
+Starts server.py with --profile, toggles sampling on around a run of the
+shared workload with SIGUSR2 and prints the hottest functions. The
+collapsed stacks are left in the output file for flame graph tools.
+'''
+import asyncio
+import getopt
+import os
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from workload import free_port, start_server, run_workload, report  # noqa: E402
+from profiler import summarise  # noqa: E402
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "o:c:m:s:",
+                                   ["output=", "clients=", "messages=", "size="])
+    except getopt.GetoptError:
+        print("-o FILE | --output=FILE Collapsed stacks, defaults to server.collapsed")
+        print("-c COUNT | --clients=COUNT Clients, defaults to 8")
+        print("-m COUNT | --messages=COUNT Messages per client, defaults to 2000")
+        print("-s BYTES | --size=BYTES Message size, defaults to 256")
+        sys.exit(1)
+
+    OUTPUT = "server.collapsed"
+    CLIENTS = 8
+    MESSAGES = 2000
+    SIZE = 256
+    for o, a in OPTS:
+        if o in ("-o", "--output"):
+            OUTPUT = a
+        elif o in ("-c", "--clients"):
+            CLIENTS = int(a)
+        elif o in ("-m", "--messages"):
+            MESSAGES = int(a)
+        elif o in ("-s", "--size"):
+            SIZE = int(a)
+
+    if os.path.exists(OUTPUT):
+        os.remove(OUTPUT)
+
+    PORT = free_port()
+    SERVER = start_server(PORT, f"--profile={os.path.abspath(OUTPUT)}")
+
+    try:
+        # the server samples from startup, the capture is restarted so it
+        # only covers the workload
+        SERVER.send_signal(signal.SIGUSR2)
+        while not os.path.exists(OUTPUT):
+            time.sleep(0.01)
+        STARTUP_DUMP = os.stat(OUTPUT).st_mtime_ns
+
+        SERVER.send_signal(signal.SIGUSR2)
+        report("workload", asyncio.run(run_workload(PORT, CLIENTS, MESSAGES, SIZE)))
+        SERVER.send_signal(signal.SIGUSR2)
+
+        while os.stat(OUTPUT).st_mtime_ns == STARTUP_DUMP:
+            time.sleep(0.01)
+        time.sleep(0.1)
+    finally:
+        SERVER.kill()
+
+    summarise(OUTPUT)
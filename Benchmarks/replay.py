@@ -0,0 +1,286 @@
+'''
+Replays captured traffic against server implementations and compares them.
+
+Every connection of a capture (see capture.py) is reopened and sends what
+its client sent, at the recorded pace times --speed, or as fast as
+possible with --speed=max. A client message is never sent before the
+server messages recorded ahead of it have arrived, so a replay keeps the
+order a conversation depends on at any speed. At full speed, a message
+that follows one the server does not answer on another connection waits
+SWITCH_DELAY.
+
+What every connection receives is checked against the capture: the same
+messages, in any order, with timestamps masked. Presence deltas are
+batched by time and left out, snapshots are compared by roster. Reported
+are the messages per second, and the latency of every server message from
+the client message it followed in the capture. Every server passed with
+--server is compared against the current one:
+    python3 Benchmarks/replay.py --speed=max --server=other_server.py captures/*.capture
+'''
+import asyncio
+import getopt
+import os
+import re
+import sys
+import time
+from bisect import bisect_right
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import capture  # noqa: E402
+from workload import free_port, start_server  # noqa: E402
+
+# Seconds to wait for the server messages a client message follows, and
+# for the last ones once everything is sent
+BARRIER_TIMEOUT = 2
+DRAIN_TIMEOUT = 2
+
+# At full speed, seconds the server gets to handle a message it does not
+# answer before another connection sends
+SWITCH_DELAY = 0.001
+
+SESSION = re.compile(rb"session \S+ ")
+STAMP = re.compile(rb"\b\d{9,}\.\d+\b")
+
+
+class Script:
+    '''
+    A capture prepared for replaying
+    '''
+
+    def __init__(self, path):
+        self.server_args, records = capture.load(path)
+
+        # (time, conn, data, {conn: server messages that must have arrived})
+        self.sends = []
+        # conn => [(message, index in sends of the client message it followed)]
+        self.expected = {}
+        self.client_messages = 0
+        readers = {}
+
+        for (stamp, conn, side, data) in records:
+            reader = readers.setdefault((conn, side), capture.FrameReader())
+            messages = reader.feed(data)
+
+            if side == "client":
+                self.client_messages += len(messages)
+                self.sends.append((stamp, conn, data, {
+                    name: len(expected) for name, expected in self.expected.items()}))
+            else:
+                self.expected.setdefault(conn, []).extend(
+                    (message, len(self.sends) - 1) for message in messages)
+
+        self.duration = records[-1][0] if records else 0
+
+
+def outcome(messages) -> Counter:
+    '''
+    The messages of a connection in comparable form, with timestamps
+    masked. Presence deltas depend on how changes fell into batch windows
+    and are left out, snapshots are compared by their roster.
+    '''
+    counts = Counter()
+
+    for message in messages:
+        match = SESSION.match(message)
+        prefix = match.group() if match else b""
+        msg_type, _, rest = message[len(prefix):].partition(b" ")
+
+        if msg_type == b"presence_snapshot":
+            counts[prefix + msg_type + b" " + b" ".join(sorted(rest.split()[1:]))] += 1
+        elif msg_type != b"presence_delta":
+            counts[STAMP.sub(b"<time>", message)] += 1
+
+    return counts
+
+
+def differences(script, received) -> list:
+    '''
+    Descriptions of where the received messages differ from the capture
+    '''
+    found = []
+
+    for conn in sorted(set(script.expected) | set(received)):
+        expected = outcome(message for (message, _) in script.expected.get(conn, []))
+        got = outcome(message for (_, message) in received.get(conn, []))
+
+        for message in sorted((expected - got).elements()):
+            found.append(f"{conn}: missing {message[:60]!r}")
+        for message in sorted((got - expected).elements()):
+            found.append(f"{conn}: unexpected {message[:60]!r}")
+
+    return found
+
+
+async def replay(port, script, speed):
+    '''
+    Replays the script, returns the (arrival time, message) received by
+    every connection, the time every client message was sent, and the
+    number of sends that timed out waiting for server messages
+    '''
+    received = {}
+    writers = {}
+    sent = []
+    stalls = 0
+    progress = asyncio.Event()
+
+    async def read(conn, reader):
+        frames = capture.FrameReader()
+
+        while data := await reader.read(65536):
+            now = time.monotonic()
+            received[conn].extend((now, message) for message in frames.feed(data))
+            progress.set()
+
+    async def wait_for(counts, timeout) -> bool:
+        deadline = time.monotonic() + timeout
+
+        while any(len(received.get(conn, ())) < count for conn, count in counts.items()):
+            progress.clear()
+            try:
+                await asyncio.wait_for(progress.wait(), deadline - time.monotonic())
+            except (asyncio.TimeoutError, ValueError):
+                return False
+
+        return True
+
+    readers = []
+    previous = (None, None)
+    start = time.monotonic()
+
+    for (stamp, conn, data, barrier) in script.sends:
+        if speed:
+            await asyncio.sleep(start + stamp / speed - time.monotonic())
+        elif conn != previous[0] and barrier == previous[1]:
+            # nothing the server sends orders this after the previous send
+            await asyncio.sleep(SWITCH_DELAY)
+        previous = (conn, barrier)
+
+        if not await wait_for(barrier, BARRIER_TIMEOUT):
+            stalls += 1
+
+        if conn not in writers:
+            (reader, writers[conn]) = await asyncio.open_connection("localhost", port)
+            received[conn] = []
+            readers.append(asyncio.create_task(read(conn, reader)))
+
+        writers[conn].write(data)
+        sent.append(time.monotonic())
+        await writers[conn].drain()
+
+    await wait_for({conn: len(expected) for conn, expected in script.expected.items()},
+                   DRAIN_TIMEOUT)
+
+    for writer in writers.values():
+        writer.close()
+    for task in readers:
+        task.cancel()
+
+    return received, sent, stalls
+
+
+def run(server, script, speed):
+    '''
+    Replays the script against a freshly started server, returns a dict
+    with the elapsed seconds, the messages per second, the sorted
+    latencies in us, the differences to the capture and the stalls, or
+    None if the server does not start with the capture's arguments
+    '''
+    port = free_port()
+    try:
+        process = start_server(port, *script.server_args, server=server)
+    except RuntimeError:
+        return None
+
+    start = time.monotonic()
+
+    try:
+        (received, sent, stalls) = asyncio.run(replay(port, script, speed))
+    finally:
+        process.kill()
+        process.wait()
+
+    latencies = []
+    last = sent[-1] if sent else start
+
+    for (conn, messages) in received.items():
+        expected = script.expected.get(conn, [])
+
+        for ((arrival, _), (_, cause)) in zip(messages, expected):
+            # recorded reads may lag, a message can only follow what was
+            # sent before it arrived
+            cause = min(cause, bisect_right(sent, arrival) - 1)
+            if cause >= 0:
+                latencies.append((arrival - sent[cause]) * 1e6)
+        if messages:
+            last = max(last, messages[-1][0])
+
+    elapsed = max(last - start, 1e-9)
+    count = script.client_messages + sum(len(messages) for messages in received.values())
+
+    return {"elapsed": elapsed, "rate": count / elapsed, "latencies": sorted(latencies),
+            "differences": differences(script, received), "stalls": stalls}
+
+
+def report(name, result, baseline=None):
+    '''
+    Prints a run and how it compares to the baseline run
+    '''
+    if result is None:
+        print(f"  {name}: did not start")
+        return
+
+    latencies = result["latencies"] or [0]
+
+    def percentile(fraction):
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+    line = (f"  {name}: {result['elapsed']:.2f} s, {result['rate']:.0f} msg/s, "
+            f"latency p50 {percentile(0.5):.0f} us, p99 {percentile(0.99):.0f} us")
+
+    if baseline:
+        line += f", throughput {result['rate'] / baseline['rate'] - 1:+.0%}"
+
+    differences = result["differences"]
+    line += ", output equivalent" if not differences else \
+        f", output differs in {len(differences)} messages"
+    if result["stalls"]:
+        line += f", {result['stalls']} sends stalled"
+    print(line)
+
+    for difference in differences[:5]:
+        print(f"    {difference}")
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "x:s:", ["speed=", "server="])
+    except getopt.GetoptError:
+        OPTS, ARGS = [], []
+
+    if not ARGS:
+        print("Usage: python3 Benchmarks/replay.py [OPTIONS] CAPTURE_FILE [CAPTURE_FILE ...]")
+        print("-x SPEED | --speed=SPEED Multiple of the recorded pace, or max, defaults to 1")
+        print("-s FILE | --server=FILE Another server implementation to compare against")
+        sys.exit(1)
+
+    SPEED = 1
+    SERVERS = ["server.py"]
+    for o, a in OPTS:
+        if o in ("-x", "--speed"):
+            SPEED = 0 if a == "max" else float(a)
+        elif o in ("-s", "--server"):
+            SERVERS.append(a)
+
+    for PATH in ARGS:
+        SCRIPT = Script(PATH)
+        print(f"{PATH}: {len(SCRIPT.sends)} client reads over {SCRIPT.duration:.2f} s, "
+              f"speed {SPEED or 'max'}{'x' if SPEED else ''}")
+
+        BASELINE = None
+        for SERVER in SERVERS:
+            RESULT = run(SERVER, SCRIPT, SPEED)
+            report(SERVER, RESULT, BASELINE)
+            BASELINE = BASELINE or RESULT
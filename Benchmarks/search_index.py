@@ -0,0 +1,106 @@
+'''
+Measures the search index at a million messages.
+
+Fills a MessageIndex with synthetic messages between a set of users, with
+words drawn from a Zipf-like vocabulary, then times searches of one and
+two words, the time to write and read the index file and its size.
+'''
+import getopt
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from search import MessageIndex  # noqa: E402
+
+
+def fill(index, messages, users, vocabulary, length, rng):
+    '''
+    Adds messages of length words, each from one user to two others
+    '''
+    words = [f"w{i}" for i in range(vocabulary)]
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    names = [f"user{i}" for i in range(users)]
+
+    for _ in range(messages):
+        sender, *recipients = rng.sample(names, 3)
+        text = " ".join(rng.choices(words, cum_weights=cum_weights, k=length))
+        index.add(sender, recipients, text)
+
+
+def time_searches(index, queries, users, rng):
+    '''
+    Returns the sorted latencies in us of searching queries
+    '''
+    latencies = []
+
+    for query in queries:
+        username = f"user{rng.randrange(users)}"
+        start = time.perf_counter_ns()
+        index.search(username, query)
+        latencies.append((time.perf_counter_ns() - start) / 1000)
+
+    return sorted(latencies)
+
+
+def report(name, latencies):
+    '''
+    Prints latency percentiles in us
+    '''
+    def percentile(fraction):
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+    print(f"{name}: p50 {percentile(0.5):.1f} us, p99 {percentile(0.99):.1f} us, "
+          f"max {latencies[-1]:.1f} us")
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "m:u:v:", ["messages=", "users=", "vocabulary="])
+    except getopt.GetoptError:
+        print("-m COUNT | --messages=COUNT Messages indexed, defaults to 1000000")
+        print("-u COUNT | --users=COUNT Users, defaults to 1000")
+        print("-v COUNT | --vocabulary=COUNT Distinct words, defaults to 50000")
+        sys.exit(1)
+
+    MESSAGES = 1000000
+    USERS = 1000
+    VOCABULARY = 50000
+    for o, a in OPTS:
+        if o in ("-m", "--messages"):
+            MESSAGES = int(a)
+        elif o in ("-u", "--users"):
+            USERS = int(a)
+        elif o in ("-v", "--vocabulary"):
+            VOCABULARY = int(a)
+
+    RNG = random.Random(1)
+    PATH = os.path.join(tempfile.mkdtemp(), "bench.index")
+    INDEX = MessageIndex(PATH, max_messages=MESSAGES)
+
+    START = time.perf_counter()
+    fill(INDEX, MESSAGES, USERS, VOCABULARY, 8, RNG)
+    print(f"indexed {MESSAGES} messages in {time.perf_counter() - START:.1f} s, "
+          f"{len(INDEX.postings)} keys")
+
+    # common, mid-frequency and rare words, alone and in pairs
+    report("one word", time_searches(
+        INDEX, [f"w{RNG.choice([0, 10, 100, 1000, 10000])}" for _ in range(1000)], USERS, RNG))
+    report("two words", time_searches(
+        INDEX, [f"w{RNG.randrange(100)} w{RNG.randrange(1000)}" for _ in range(1000)], USERS, RNG))
+
+    START = time.perf_counter()
+    INDEX.dump()
+    print(f"dump: {time.perf_counter() - START:.1f} s, "
+          f"{os.path.getsize(PATH) / 2 ** 20:.1f} MiB")
+
+    START = time.perf_counter()
+    MessageIndex(PATH, max_messages=MESSAGES).load()
+    print(f"load: {time.perf_counter() - START:.1f} s")
+
+    os.remove(PATH)
+    os.rmdir(os.path.dirname(PATH))
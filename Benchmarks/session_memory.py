@@ -0,0 +1,113 @@
+'''
+Measures the Python heap held per idle server session.
+
+Creates idle Sessions over socket pairs and compares the tracemalloc totals
+with Session.memory_usage(), once for the Session alone and once with the
+handler thread the server starts for every direct client, and does the same
+for the sessions of users joined through a gateway. Each is checked against
+the goal of TARGET bytes per idle connection: the handler thread alone takes
+more than that, only users joined through gateways stay within it.
+'''
+import getopt
+import os
+import socket
+import sys
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import util  # noqa: E402
+from server import Gateway, LogicalSession, Session  # noqa: E402
+
+TARGET = 2048
+
+
+def measure(count, with_threads):
+    '''
+    Returns (traced bytes per session, reported bytes per session)
+    '''
+    pairs = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    sessions = []
+    for _ in range(count):
+        ours, theirs = socket.socketpair()
+        pairs.append(theirs)
+        sessions.append(Session(ours, "user"))
+
+    threads = []
+    if with_threads:
+        for session in sessions:
+            thread = threading.Thread(
+                target=session.receive_frame, daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    reported = sum(session.memory_usage() for session in sessions)
+
+    for theirs in pairs:
+        theirs.close()
+    for thread in threads:
+        thread.join()
+    for session in sessions:
+        session.close()
+
+    return traced // count, reported // count
+
+
+def measure_gateway(count):
+    '''
+    Returns (traced bytes per session, reported bytes per session) for the
+    sessions of one gateway
+    '''
+    ours, theirs = socket.socketpair()
+    gateway = Gateway("gateway", Session(ours, "gateway"))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    sessions = []
+    for i in range(count):
+        gateway.sessions[str(i)] = f"user{i}"
+        sessions.append(LogicalSession(gateway, str(i), f"user{i}"))
+
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    reported = sum(session.memory_usage() for session in sessions)
+
+    theirs.close()
+    gateway.conn.close()
+
+    return traced // count, reported // count
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "n:", ["sessions="])
+    except getopt.GetoptError:
+        print("-n COUNT | --sessions=COUNT Number of idle sessions, defaults to 400")
+        sys.exit(1)
+
+    COUNT = 400
+    for o, a in OPTS:
+        if o in ("-n", "--sessions"):
+            COUNT = int(a)
+
+    RESULTS = [("session", measure(COUNT, False)),
+               ("session + handler thread", measure(COUNT, True)),
+               ("gateway session", measure_gateway(COUNT))]
+
+    for label, (traced, reported) in RESULTS:
+        verdict = "within" if traced <= TARGET else f"{traced - TARGET} bytes over"
+        print(f"{label}: {traced} bytes traced, {reported} bytes reported per session, "
+              f"{verdict} the {TARGET} byte target")
+
+    # the stats command adds HANDLER_THREAD_MEMORY per thread, keep it in line
+    THREAD = RESULTS[1][1][0] - RESULTS[0][1][0]
+    print(f"handler thread: {THREAD} bytes traced, the stats command counts "
+          f"{util.HANDLER_THREAD_MEMORY}")
@@ -0,0 +1,226 @@
+'''
+Measures the socket tuning and the server's write coalescing over loopback.
+
+nagle: round trips of a small frame written as header and message in two
+    sends, the way a frame built from several parts can reach the wire,
+    with and without TCP_NODELAY.
+coalesce: several threads sending small frames to one peer through a
+    Session, against the previous Session.send_frame that took turns on
+    the send lock and wrote every frame on its own.
+bulk: time to relay large frames with the default socket buffers and with
+    util.SOCKET_BUFFER_SIZE.
+'''
+import getopt
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import util  # noqa: E402
+from server import Session  # noqa: E402
+
+
+class LegacySession(Session):
+    '''
+    Session with the previous send_frame: every frame written on its own
+    '''
+    __slots__ = ()
+
+    def send_frame(self, *parts, trace_id=0):
+        '''
+        Waits for the send lock, then writes the frame
+        '''
+        with self.send_lock:
+            self.outbox.append(
+                (util.pack_header(sum(len(part) for part in parts), trace_id), ) + parts)
+            self.flush()
+
+
+class CountingSocket:
+    '''
+    Socket wrapper that counts sendmsg calls
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        '''
+        Counts and forwards the call
+        '''
+        self.calls += 1
+        return self.sock.sendmsg(buffers)
+
+
+def tcp_pair():
+    '''
+    Returns two connected loopback TCP sockets
+    '''
+    with socket.socket() as listener:
+        listener.bind(("localhost", 0))
+        listener.listen()
+        client = socket.create_connection(listener.getsockname())
+        (server, _) = listener.accept()
+
+    return client, server
+
+
+def drain(sock, size):
+    '''
+    Reads and discards size bytes
+    '''
+    buffer = bytearray(1 << 20)
+
+    while size > 0:
+        count = sock.recv_into(buffer)
+        if not count:
+            return
+        size -= count
+
+
+def percentile(values, fraction):
+    '''
+    Percentile of sorted values
+    '''
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def nagle(rounds, nodelay):
+    '''
+    Returns the sorted round trip times in us of a split write
+    '''
+    client, server = tcp_pair()
+
+    for sock in (client, server):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+
+    message = b"send_message 1 bob hello"
+    header = util.FRAME_HEADER.pack(len(message))
+
+    def echo():
+        for _ in range(rounds):
+            data = util.recv_exactly(server, len(header) + len(message))
+            server.send(data[:len(header)])
+            server.send(data[len(header):])
+
+    thread = threading.Thread(target=echo)
+    thread.start()
+
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        client.send(header)
+        client.send(message)
+        util.recv_exactly(client, len(header) + len(message))
+        times.append((time.perf_counter_ns() - start) / 1000)
+
+    thread.join()
+    client.close()
+    server.close()
+
+    return sorted(times)
+
+
+def coalesce(session_class, threads, frames, size):
+    '''
+    Returns (frames per second, sendmsg calls, sorted send_frame times in us)
+    '''
+    client, server = tcp_pair()
+    util.tune_socket(client)
+    counter = CountingSocket(client)
+    session = session_class(counter)
+    payload = memoryview(b"x" * size)
+    times = []
+
+    def send():
+        own = []
+        for _ in range(frames):
+            start = time.perf_counter_ns()
+            session.send_frame(b"forward_message alice ", payload)
+            own.append((time.perf_counter_ns() - start) / 1000)
+        times.extend(own)
+
+    reader = threading.Thread(
+        target=drain, args=(server, threads * frames * (26 + size)))
+    reader.start()
+
+    start = time.perf_counter()
+    senders = [threading.Thread(target=send) for _ in range(threads)]
+    for thread in senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+    reader.join()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    server.close()
+
+    return threads * frames / elapsed, counter.calls, sorted(times)
+
+
+def bulk(frames, size, tuned):
+    '''
+    Returns MiB per second of relaying frames of size bytes
+    '''
+    client, server = tcp_pair()
+
+    if tuned:
+        util.tune_socket(client, bulk=True)
+        util.tune_socket(server, bulk=True)
+
+    session = Session(client)
+    payload = b"x" * size
+    reader = threading.Thread(target=drain, args=(server, frames * (4 + size)))
+    reader.start()
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        session.send_frame(payload)
+    reader.join()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    server.close()
+
+    return frames * size / elapsed / 2 ** 20
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "t:f:s:", ["threads=", "frames=", "size="])
+    except getopt.GetoptError:
+        print("-t COUNT | --threads=COUNT Sending threads, defaults to 8")
+        print("-f COUNT | --frames=COUNT Frames per thread, defaults to 5000")
+        print("-s BYTES | --size=BYTES Message size, defaults to 64")
+        sys.exit(1)
+
+    THREADS = 8
+    FRAMES = 5000
+    SIZE = 64
+    for o, a in OPTS:
+        if o in ("-t", "--threads"):
+            THREADS = int(a)
+        elif o in ("-f", "--frames"):
+            FRAMES = int(a)
+        elif o in ("-s", "--size"):
+            SIZE = int(a)
+
+    for NODELAY in (False, True):
+        TIMES = nagle(200, NODELAY)
+        print(f"nagle, TCP_NODELAY {'on' if NODELAY else 'off'}: round trip "
+              f"p50 {percentile(TIMES, 0.5):.0f} us, p99 {percentile(TIMES, 0.99):.0f} us")
+
+    for NAME, CLASS in (("legacy", LegacySession), ("coalescing", Session)):
+        RATE, CALLS, TIMES = coalesce(CLASS, THREADS, FRAMES, SIZE)
+        print(f"coalesce, {NAME}: {RATE:.0f} frames/s, "
+              f"{THREADS * FRAMES / CALLS:.1f} frames per sendmsg, send_frame "
+              f"p50 {percentile(TIMES, 0.5):.1f} us, p99 {percentile(TIMES, 0.99):.1f} us")
+
+    for TUNED in (False, True):
+        print(f"bulk, {'tuned' if TUNED else 'default'} buffers: "
+              f"{bulk(64, 4 * 2 ** 20, TUNED):.0f} MiB/s")
@@ -0,0 +1,153 @@
+'''
+Measures the server's memory while large files go to slow recipients.
+
+Every sender sends a file to its own recipient, which reads at a limited
+rate. The server's resident set size is sampled from /proc during the
+transfers and its peak growth reported, for the current server and for
+any other server implementation passed with --server to compare against.
+'''
+import asyncio
+import getopt
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import util  # noqa: E402
+from workload import free_port, start_server  # noqa: E402
+from client import AsyncClient  # noqa: E402
+
+
+def rss(pid) -> int:
+    '''
+    Resident set size of a process in bytes
+    '''
+    with open(f"/proc/{pid}/status", encoding="UTF-8") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+
+def slow_recipient(port, username, size, rate, done):
+    '''
+    Joins as username and reads size bytes at rate bytes per second
+    '''
+    sock = socket.create_connection(("localhost", port))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+    sock.sendall(util.pack_frame(f"join {username}".encode("utf-8")))
+
+    chunk = 64 * 1024
+    received = 0
+    start = time.monotonic()
+
+    while received < size:
+        data = sock.recv(chunk)
+        if not data:
+            break
+        received += len(data)
+
+        ahead = received / rate - (time.monotonic() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    sock.close()
+    done.set()
+
+
+async def send_files(port, path, senders):
+    '''
+    Every sender sends the file to its recipient
+    '''
+    users = [AsyncClient(f"sender{i}", "localhost", port) for i in range(senders)]
+
+    for user in users:
+        await user.connect()
+        await user.join()
+
+    while len(await users[0].list_users()) < 2 * senders:
+        await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(user.send_file([f"recipient{i}"], path)
+                           for i, user in enumerate(users)))
+
+    return users
+
+
+def run(server, senders, size, rate):
+    '''
+    Returns (peak RSS growth in bytes, seconds) of one run
+    '''
+    port = free_port()
+    process = start_server(port, server=server)
+    baseline = rss(process.pid)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+        file.write("x" * size)
+
+    recipients = []
+    for i in range(senders):
+        done = threading.Event()
+        threading.Thread(target=slow_recipient, daemon=True,
+                         args=(port, f"recipient{i}", size, rate, done)).start()
+        recipients.append(done)
+
+    peak = baseline
+    start = time.monotonic()
+
+    async def transfer():
+        nonlocal peak
+        users = await send_files(port, file.name, senders)
+
+        while not all(done.is_set() for done in recipients):
+            peak = max(peak, rss(process.pid))
+            await asyncio.sleep(0.01)
+
+        for user in users:
+            await user.close()
+
+    asyncio.run(transfer())
+    elapsed = time.monotonic() - start
+
+    process.kill()
+    process.wait()
+    os.remove(file.name)
+
+    return peak - baseline, elapsed
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "c:m:r:s:",
+                                   ["senders=", "size=", "rate=", "server="])
+    except getopt.GetoptError:
+        print("-c COUNT | --senders=COUNT Files sent at once, defaults to 4")
+        print("-m MIB | --size=MIB File size, defaults to 64")
+        print("-r MIB | --rate=MIB Read rate of every recipient per second, defaults to 32")
+        print("-s FILE | --server=FILE Another server implementation to compare against")
+        sys.exit(1)
+
+    SENDERS = 4
+    SIZE = 64
+    RATE = 32
+    SERVERS = ["server.py"]
+    for o, a in OPTS:
+        if o in ("-c", "--senders"):
+            SENDERS = int(a)
+        elif o in ("-m", "--size"):
+            SIZE = int(a)
+        elif o in ("-r", "--rate"):
+            RATE = int(a)
+        elif o in ("-s", "--server"):
+            SERVERS.append(a)
+
+    for SERVER in SERVERS:
+        GROWTH, ELAPSED = run(SERVER, SENDERS, SIZE * 2 ** 20, RATE * 2 ** 20)
+        print(f"{SERVER}: {SENDERS} x {SIZE} MiB to recipients reading {RATE} MiB/s, "
+              f"peak RSS growth {GROWTH / 2 ** 20:.1f} MiB, {ELAPSED:.1f} s")
@@ -0,0 +1,120 @@
+'''
+Measures server startup and graceful restarts.
+
+Reports the time from launching server.py until it accepts a connection,
+then keeps a pair of clients exchanging messages while the server is
+restarted with SIGHUP, and reports the longest delivery gap the clients
+saw and whether every message arrived over the original connections.
+'''
+import asyncio
+import getopt
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from workload import ROOT, free_port, start_server  # noqa: E402
+from client import AsyncClient  # noqa: E402
+
+
+def cold_start(port) -> float:
+    '''
+    Seconds from launching a server until it accepts a connection
+    '''
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "-p", str(port)],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.001)
+
+    elapsed = time.monotonic() - start
+    process.kill()
+    process.wait()
+
+    return elapsed
+
+
+async def restart_gap(port, messages, interval) -> dict:
+    '''
+    Sends messages from one client to another every interval seconds and
+    restarts the server half way. Returns the messages received and the
+    longest gap between two of them in seconds.
+    '''
+    process = start_server(port)
+    sender = AsyncClient("sender", "localhost", port)
+    receiver = AsyncClient("receiver", "localhost", port)
+
+    for user in (sender, receiver):
+        await user.connect()
+        await user.join()
+
+    while len(await sender.list_users()) < 2:
+        await asyncio.sleep(0.01)
+
+    arrivals = []
+
+    async def receive():
+        async for _ in receiver.events():
+            arrivals.append(time.monotonic())
+            if len(arrivals) == messages:
+                return
+
+    receiving = asyncio.create_task(receive())
+
+    for count in range(messages):
+        if count == messages // 2:
+            process.send_signal(signal.SIGHUP)
+        await sender.send_message(["receiver"], str(count))
+        await asyncio.sleep(interval)
+
+    try:
+        await asyncio.wait_for(receiving, 10)
+    except asyncio.TimeoutError:
+        pass
+
+    await sender.close()
+    await receiver.close()
+
+    # the server that took over is a child of the old one, not of this process
+    subprocess.run(["pkill", "-f", f"server.py -p {port}"], check=False)
+    process.wait()
+
+    gaps = [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]
+
+    return {"received": len(arrivals), "gap": max(gaps, default=0)}
+
+
+if __name__ == "__main__":
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "r:m:", ["runs=", "messages="])
+    except getopt.GetoptError:
+        print("-r COUNT | --runs=COUNT Cold starts to time, defaults to 10")
+        print("-m COUNT | --messages=COUNT Messages sent across the restart, defaults to 200")
+        sys.exit(1)
+
+    RUNS = 10
+    MESSAGES = 200
+    for o, a in OPTS:
+        if o in ("-r", "--runs"):
+            RUNS = int(a)
+        elif o in ("-m", "--messages"):
+            MESSAGES = int(a)
+
+    TIMES = sorted(cold_start(free_port()) for _ in range(RUNS))
+    print(f"cold start: median {TIMES[len(TIMES) // 2] * 1000:.1f} ms, "
+          f"min {TIMES[0] * 1000:.1f} ms")
+
+    RESULT = asyncio.run(restart_gap(free_port(), MESSAGES, 0.005))
+    print(f"restart: {RESULT['received']}/{MESSAGES} messages received, "
+          f"longest gap {RESULT['gap'] * 1000:.1f} ms")
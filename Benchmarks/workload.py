@@ -0,0 +1,107 @@
+'''
+Shared load generator for the benchmarks.
+
+Starts a server in a subprocess and drives it with AsyncClients that send
+each other timestamped messages, reporting throughput and latency.
+'''
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from client import AsyncClient  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port() -> int:
+    '''
+    Returns a TCP port that is currently free on localhost
+    '''
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, *args, server="server.py", stdout=subprocess.DEVNULL):
+    '''
+    Starts a server and waits until it accepts connections.
+    Its stdin is kept open as a pipe for admin commands.
+    '''
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, server), "-p", str(port), *args],
+        stdin=subprocess.PIPE, stdout=stdout)
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.01)
+
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+async def run_workload(port, clients=8, messages=200, size=64):
+    '''
+    Every client sends messages of size bytes to the next client.
+    Returns a dict with the elapsed seconds, the messages delivered and
+    the sorted delivery latencies in us.
+    '''
+    users = [AsyncClient(f"load{i}", "localhost", port) for i in range(clients)]
+
+    for user in users:
+        await user.connect()
+        await user.join()
+
+    # a list round trip makes sure every join has been handled
+    while len(await users[0].list_users()) < clients:
+        await asyncio.sleep(0.01)
+
+    latencies = []
+
+    async def receive(user):
+        count = 0
+        async for event in user.events():
+            latencies.append(
+                (time.monotonic_ns() - int(event.data.split(" ", 1)[0])) / 1000)
+            count += 1
+            if count == messages:
+                return
+
+    async def send(user, recipient):
+        for _ in range(messages):
+            stamp = str(time.monotonic_ns())
+            await user.send_message([recipient], stamp + " " + "x" * max(size - len(stamp) - 1, 0))
+
+    start = time.monotonic()
+    receivers = [asyncio.create_task(receive(user)) for user in users]
+    await asyncio.gather(*(send(user, f"load{(i + 1) % clients}")
+                           for i, user in enumerate(users)))
+    await asyncio.wait_for(asyncio.gather(*receivers), 60)
+    elapsed = time.monotonic() - start
+
+    for user in users:
+        await user.close()
+
+    return {"elapsed": elapsed, "messages": len(latencies),
+            "latencies": sorted(latencies)}
+
+
+def report(name, result):
+    '''
+    Prints throughput and latency percentiles of a run_workload result
+    '''
+    latencies = result["latencies"]
+
+    def percentile(fraction):
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+    print(f"{name}: {result['messages'] / result['elapsed']:.0f} msg/s, "
+          f"latency p50 {percentile(0.5):.0f} us, p99 {percentile(0.99):.0f} us")
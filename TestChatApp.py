@@ -6,7 +6,8 @@ import time
 import random
 import signal
 import util
-from Tests import SingleClientTest, BasicTest, MultipleClientsTest, ErrorHandlingTest, FileSharingTest
+import capture
+from Tests import SingleClientTest, BasicTest, MultipleClientsTest, ErrorHandlingTest, FileSharingTest, ChannelTest, PresenceTest, SearchTest, LargeFileTest, ChannelStressTest, GatewayTest
 
 
 def tests_to_run(forwarder):
@@ -14,6 +15,12 @@ def tests_to_run(forwarder):
     MultipleClientsTest.MultipleClientsTest(forwarder, "MultipleClients")
     FileSharingTest.FileSharingTest(forwarder, 'FileSharing')
     ErrorHandlingTest.ErrorHandlingTest(forwarder, "ErrorHandling")
+    ChannelTest.ChannelTest(forwarder, "Channels")
+    ChannelStressTest.ChannelStressTest(forwarder, "ChannelStress")
+    PresenceTest.PresenceTest(forwarder, "Presence")
+    SearchTest.SearchTest(forwarder, "Search")
+    LargeFileTest.LargeFileTest(forwarder, "LargeFile")
+    GatewayTest.GatewayTest(forwarder, "Gateway")
 
 
 class Forwarder(object):
@@ -43,6 +50,11 @@ class Forwarder(object):
         self.receiver_port = self.port + 1
         self.receiver_addr = None
 
+        # traffic of every test is recorded to capture_dir/<test>.capture
+        self.capture_dir = None
+        self.captured = []
+        self.capture_start = time.time()
+
     def _tick(self):
         self.current_test.handle_tick(self.tick_interval)
         for p, user in self.out_queue:
@@ -81,6 +93,10 @@ class Forwarder(object):
             self.start()
 
     def handle_receive(self, message, sender, user):
+        if self.capture_dir:
+            self.captured.append((time.time() - self.capture_start, user,
+                                  sender[:-len("side")], message))
+
         if sender == "clientside":
             m = MessageWrapper(message, "serverside")
         elif sender == "serverside":
@@ -96,11 +112,13 @@ class Forwarder(object):
         recv_out = open(self.recv_outfile, "w")
         receiver = subprocess.Popen(
             ["python3", self.receiver_path, "-p",
-             str(self.receiver_port)],
+             str(self.receiver_port)] + self.current_test.server_args,
             stdout=recv_out)
         time.sleep(0.2)  # make sure the receiver is started first
         self.senders = {}
         sender_out = {}
+        self.captured = []
+        self.capture_start = time.time()
         for i in sorted(list(self.current_test.client_stdin.keys())):
             u = i
             sender_out[i] = open("client_" + i, "w")
@@ -172,6 +190,10 @@ class Forwarder(object):
         except Exception as e:
             print("Test Failed!", e)
 
+        if self.capture_dir:
+            capture.save(os.path.join(self.capture_dir, "%s.capture" % self.tests[self.current_test]),
+                         self.captured, self.current_test.server_args)
+
 
 class MessageWrapper(object):
     def __init__(self, message, receiver):
@@ -191,11 +213,14 @@ if __name__ == "__main__":
         print(
             "-s SERVER | --server SERVER The path to the Server implementation (default: server.py)"
         )
+        print(
+            "--capture DIR Record the traffic of every test to DIR/<test>.capture for Benchmarks/replay.py"
+        )
         print("-h | --help Print this usage message")
 
     try:
         opts, args = getopt.getopt(sys.argv[1:], "c:s:",
-                                   ["client=", "server="])
+                                   ["client=", "server=", "capture="])
     except:
         usage()
         exit()
@@ -203,13 +228,18 @@ if __name__ == "__main__":
     port = random.randint(2000, 65500)
     sender = "client.py"
     receiver = "server.py"
+    capture_dir = None
 
     for o, a in opts:
         if o in ("-c", "--client"):
             sender = a
         elif o in ("-s", "--server"):
             receiver = a
+        elif o == "--capture":
+            capture_dir = a
+            os.makedirs(capture_dir, exist_ok=True)
 
     f = Forwarder(sender, receiver, port)
+    f.capture_dir = capture_dir
     tests_to_run(f)
     f.execute_tests()
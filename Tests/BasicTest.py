@@ -14,6 +14,7 @@ class BasicTest(object):
         self.input_to_check = []
         self.last_time = time.time()
         self.time_interval = 0.5
+        self.server_args = []
 
     def set_state(self):
         pass
@@ -37,6 +38,8 @@ class BasicTest(object):
 
         elif time.time() - self.last_time > 0.5:
             for client in self.forwarder.senders.keys():
+                if self.forwarder.senders[client].poll() is not None:
+                    continue
                 self.forwarder.senders[client].stdin.write("quit\n".encode())
                 self.forwarder.senders[client].stdin.flush()
             self.last_time = None
@@ -0,0 +1,86 @@
+import socket
+import threading
+from .BasicTest import *
+
+
+class ChannelStressTest(BasicTest):
+    def set_state(self):
+        self.num_of_clients = 2
+        self.client_stdin = {"client1": 1, "client2": 2}
+        self.num_of_stressers = 6
+        self.num_of_reconnects = 10
+        self.stressers = []
+
+        # the stressers connect to the server directly, the forwarder
+        # would serialize them
+        self.rounds = [lambda: self.write("client1", "channel create team\n"),
+                       self.start_stressers,
+                       lambda: [thread.join() for thread in self.stressers],
+                       lambda: self.write("client2", "quit\n"),
+                       lambda: self.write("client1", "list\n"),
+                       lambda: self.write("client1", "quit\n")]
+        self.last_time = time.time()
+
+    def write(self, client, inpt):
+        self.forwarder.senders[client].stdin.write(inpt.encode())
+        self.forwarder.senders[client].stdin.flush()
+
+    def start_stressers(self):
+        self.write("client2", "channel join team\n" +
+                   "channel leave team\nchannel join team\n" * 50)
+
+        for i in range(self.num_of_stressers):
+            thread = threading.Thread(target=self.stress, args=("stresser%d" % i, ))
+            thread.start()
+            self.stressers.append(thread)
+
+    def stress(self, name):
+        # members are kept by username, every reconnect under a new name
+        # makes the channel larger
+        churn = (util.pack_frame(b"join_channel team") +
+                 util.pack_frame(b"leave_channel team")) * 20
+
+        for i in range(self.num_of_reconnects):
+            username = "%s_%d" % (name, i)
+            sock = socket.create_connection(self.forwarder.receiver_addr)
+            sock.sendall(util.pack_frame(("join %s" % username).encode()) + churn)
+            # disconnect while still a member, so the channel is refreshed
+            sock.sendall(util.pack_frame(b"join_channel team") +
+                         util.pack_frame(("disconnect %s" % username).encode()))
+            while sock.recv(4096):
+                pass
+            sock.close()
+
+    def handle_tick(self, tick_interval):
+        if not self.rounds or time.time() - self.last_time < self.time_interval:
+            return
+
+        self.rounds.pop(0)()
+        self.last_time = time.time()
+
+    def result(self):
+        # Check if Output File Exists
+        if not os.path.exists("server_out"):
+            raise ValueError("No such file server_out")
+
+        server_out = ["create_channel: client1 team"]
+        for i in range(self.num_of_stressers):
+            for j in range(self.num_of_reconnects):
+                server_out.append("disconnected: stresser%d_%d" % (i, j))
+
+        # users whose handler died would still be listed
+        with open("client_client1") as f:
+            if "list: client1" not in f.read().split("\n"):
+                print("Test Failed: Client output is not correct")
+                return False
+
+        # prints of parallel handlers can share a line
+        with open("server_out") as f:
+            text = f.read()
+            for each_line in server_out:
+                if each_line not in text:
+                    print("Test Failed: Server Output is not correct", each_line)
+                    return False
+
+        print("Test Passed")
+        return True
@@ -0,0 +1,91 @@
+from .BasicTest import *
+
+
+class ChannelTest(BasicTest):
+    def set_state(self):
+        self.num_of_clients = 3
+        self.client_stdin = {"client1": 1, "client2": 2, "client3": 3}
+        self.input = [("client1", "channel create team\n"),
+                      ("client2", "channel join team\n"),
+                      ("client3", "post team Let me in\n"),
+                      ("client1", "post team Hello team!\n"),
+                      ("client2", "channel leave team\n"),
+                      ("client1", "post team Bye\n"),
+                      ("client3", "post lobby Anyone?\n")]
+        self.last_time = time.time()
+
+    def result(self):
+        # Check if Output File Exists
+        if not os.path.exists("server_out"):
+            raise ValueError("No such file server_out")
+
+        for client in self.client_stdin.keys():
+            if not os.path.exists("client_" + client):
+                raise ValueError("No such file %s" % "client_" + client)
+
+        server_out = []
+        clients_out = {}
+        clients_not_out = {}
+        members = {}
+
+        # Checking Join
+        for client in self.client_stdin.keys():
+            server_out.append("join: %s" % client)
+            clients_out[client] = ["quitting"]
+            clients_not_out[client] = []
+            server_out.append('disconnected: %s' % client)
+
+        # Checking Output of Client Messages
+        for inp in self.input_to_check:
+            client, message = inp
+            msg = message.split()
+            if msg[0] == "channel" and msg[1] == "create":
+                server_out.append("create_channel: %s %s" % (client, msg[2]))
+                members[msg[2]] = {client}
+            elif msg[0] == "channel" and msg[1] == "join":
+                server_out.append("join_channel: %s %s" % (client, msg[2]))
+                members[msg[2]].add(client)
+            elif msg[0] == "channel" and msg[1] == "leave":
+                server_out.append("leave_channel: %s %s" % (client, msg[2]))
+                members[msg[2]].discard(client)
+            elif msg[0] == "post":
+                line = "channel: %s: %s: %s" % (
+                    msg[1], client, " ".join(msg[2:]))
+                if msg[1] not in members:
+                    server_out.append(
+                        "post: %s to non-existent channel %s" % (client, msg[1]))
+                    continue
+                if client not in members[msg[1]]:
+                    server_out.append(
+                        "post: %s to non-joined channel %s" % (client, msg[1]))
+                    continue
+                server_out.append("post: %s %s" % (client, msg[1]))
+                for each_client in clients_out:
+                    if each_client in members[msg[1]]:
+                        clients_out[each_client].append(line)
+                    else:
+                        clients_not_out[each_client].append(line)
+
+        # Checking Clients Output
+        for client in clients_out.keys():
+            with open("client_" + client) as f:
+                lines = f.read().split('\n')
+                for each_line in clients_out[client]:
+                    if each_line not in lines:
+                        print("Test Failed: Client output is not correct", each_line)
+                        return False
+                for each_line in clients_not_out[client]:
+                    if each_line in lines:
+                        print("Test Failed: Client received message from left channel")
+                        return False
+
+        # Checking Sever Output in File
+        with open("server_out") as f:
+            lines = f.read().split("\n")
+            for each_line in server_out:
+                if each_line not in lines:
+                    print("Test Failed: Server Output is not correct", each_line)
+                    return False
+
+        print("Test Passed")
+        return True
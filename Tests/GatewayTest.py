@@ -0,0 +1,118 @@
+import socket
+import threading
+from .BasicTest import *
+
+
+class GatewayTest(BasicTest):
+    def set_state(self):
+        self.num_of_clients = 1
+        self.client_stdin = {"client1": 1}
+        self.server_args = ["-g", "secret"]
+        self.denied = []
+        self.received = []
+
+        # the gateways connect to the server directly, the forwarder only
+        # knows the protocol of single users
+        self.rounds = [self.join_denied,
+                       self.join_gateway,
+                       # a broken message ends at most its own session
+                       lambda: self.send(b"session 1 send_message 1 \xff hi"),
+                       lambda: self.send(b"session 1 send_message 2 bob client1 hello from alice"),
+                       lambda: self.write("client1", "msg 1 bob hi bob\n"),
+                       lambda: self.write("client1", "list\n"),
+                       lambda: self.send(b"session 2 disconnect bob"),
+                       lambda: self.write("client1", "list\n"),
+                       lambda: self.send(b"disconnect gw"),
+                       lambda: self.write("client1", "list\n"),
+                       lambda: self.write("client1", "quit\n")]
+        self.last_time = time.time()
+
+    def write(self, client, inpt):
+        self.forwarder.senders[client].stdin.write(inpt.encode())
+        self.forwarder.senders[client].stdin.flush()
+
+    def send(self, message):
+        self.gateway.sendall(util.pack_frame(message))
+
+    def receive(self, sock, messages):
+        try:
+            while True:
+                header = util.recv_exactly(sock, util.FRAME_HEADER.size)
+                if not header:
+                    break
+                (size,) = util.FRAME_HEADER.unpack(header)
+                messages.append(util.recv_exactly(sock, size).decode())
+        except OSError:
+            messages.append("no EOF")
+
+    def join_denied(self):
+        # a token that is not ASCII must be denied like any wrong one
+        sock = socket.create_connection(self.forwarder.receiver_addr)
+        sock.settimeout(3)
+        sock.sendall(util.pack_frame("join_gateway bad sécret".encode()))
+        self.receive(sock, self.denied)
+        sock.close()
+
+    def join_gateway(self):
+        self.gateway = socket.create_connection(self.forwarder.receiver_addr)
+        self.send(b"join_gateway gw secret")
+        self.send(b"open_session 1 alice")
+        self.send(b"open_session 2 bob")
+        threading.Thread(target=self.receive, args=(self.gateway, self.received),
+                         daemon=True).start()
+
+    def handle_tick(self, tick_interval):
+        if not self.rounds or time.time() - self.last_time < self.time_interval:
+            return
+
+        self.rounds.pop(0)()
+        self.last_time = time.time()
+
+    def result(self):
+        # Check if Output File Exists
+        if not os.path.exists("server_out"):
+            raise ValueError("No such file server_out")
+
+        if self.denied != ["ERR_GATEWAY_DENIED"]:
+            print("Test Failed: Gateway was not denied", self.denied)
+            return False
+
+        gateway_out = ["session 2 forward_message alice hello from alice",
+                       "session 2 forward_message client1 hi bob"]
+        clients_out = ["msg: alice: hello from alice",
+                       "list: alice bob client1",
+                       "list: alice client1",
+                       "list: client1"]
+        server_out = ["join: client1",
+                      "disconnected: gateway bad denied",
+                      "join_gateway: gw",
+                      "join: alice",
+                      "join: bob",
+                      "msg: alice",
+                      "msg: client1",
+                      "disconnected: bob",
+                      "disconnected: alice",
+                      "disconnected: gateway gw",
+                      "disconnected: client1"]
+
+        for each_line in gateway_out:
+            if each_line not in self.received:
+                print("Test Failed: Gateway output is not correct", each_line)
+                return False
+
+        with open("client_client1") as f:
+            lines = f.read().split("\n")
+            for each_line in clients_out:
+                if each_line not in lines:
+                    print("Test Failed: Client output is not correct", each_line)
+                    return False
+
+        with open("server_out") as f:
+            lines = f.read().split("\n")
+            for each_line in server_out:
+                if each_line not in lines:
+                    print("Test Failed: Server Output is not correct", each_line)
+                    return False
+
+        print("Test Passed")
+        return True
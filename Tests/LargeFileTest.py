@@ -0,0 +1,11 @@
+from .FileSharingTest import *
+
+
+class LargeFileTest(FileSharingTest):
+    def set_state(self):
+        super().set_state()
+
+        # Without memory for receive buffers the server keeps only the first
+        # 512 bytes of a message in memory and spills the rest to disk, as
+        # it does for large files
+        self.server_args = ["--memory-limit=0"]
@@ -0,0 +1,66 @@
+from .BasicTest import *
+
+
+class PresenceTest(BasicTest):
+    def set_state(self):
+        self.num_of_clients = 3
+        self.client_stdin = {"client1": 1, "client2": 2, "client3": 3}
+        self.input = [("client1", "presence\n"),
+                      ("client1", "list\n"),
+                      ("client3", "quit\n"),
+                      ("client1", "list\n")]
+        self.last_time = time.time()
+
+    def result(self):
+        # Check if Output File Exists
+        if not os.path.exists("server_out"):
+            raise ValueError("No such file server_out")
+
+        for client in self.client_stdin.keys():
+            if not os.path.exists("client_" + client):
+                raise ValueError("No such file %s" % "client_" + client)
+
+        server_out = ["subscribe_presence: client1"]
+        server_not_out = ["request_users_list: client1"]
+        clients_out = {}
+        online = set(self.client_stdin.keys())
+
+        # Checking Join
+        for client in self.client_stdin.keys():
+            server_out.append("join: %s" % client)
+            clients_out[client] = ["quitting"]
+            server_out.append('disconnected: %s' % client)
+
+        # Checking Output of Client Messages
+        for inp in self.input_to_check:
+            client, message = inp
+            msg = message.split()
+            if msg[0] == "list":
+                clients_out[client].append(
+                    "list: %s" % " ".join(sorted(online)))
+            elif msg[0] == "quit":
+                online.discard(client)
+
+        # Checking Clients Output
+        for client in clients_out.keys():
+            with open("client_" + client) as f:
+                lines = f.read().split('\n')
+                for each_line in clients_out[client]:
+                    if each_line not in lines:
+                        print("Test Failed: Client output is not correct", each_line)
+                        return False
+
+        # Checking Sever Output in File
+        with open("server_out") as f:
+            lines = f.read().split("\n")
+            for each_line in server_out:
+                if each_line not in lines:
+                    print("Test Failed: Server Output is not correct", each_line)
+                    return False
+            for each_line in server_not_out:
+                if each_line in lines:
+                    print("Test Failed: Roster was not served locally")
+                    return False
+
+        print("Test Passed")
+        return True
@@ -0,0 +1,72 @@
+from .BasicTest import *
+
+
+class SearchTest(BasicTest):
+    def set_state(self):
+        self.num_of_clients = 3
+        self.client_stdin = {"client1": 1, "client2": 2, "client3": 3}
+        self.server_args = ["--search=search_index"]
+        self.input = [("client1", "msg 2 client2 client3 The quick brown fox\n"),
+                      ("client2", "msg 1 client1 A lazy dog\n"),
+                      ("client3", "msg 1 client2 Quick lunch?\n"),
+                      ("client1", "search quick\n"),
+                      ("client2", "search QUICK\n"),
+                      ("client3", "search dog\n"),
+                      ("client3", "search quick fox\n")]
+        self.last_time = time.time()
+
+    def result(self):
+        # Check if Output File Exists
+        if not os.path.exists("server_out"):
+            raise ValueError("No such file server_out")
+
+        for client in self.client_stdin.keys():
+            if not os.path.exists("client_" + client):
+                raise ValueError("No such file %s" % "client_" + client)
+
+        # The index is written to its file at shutdown
+        if not os.path.exists("search_index"):
+            print("Test Failed: Search index was not saved")
+            return False
+        os.remove("search_index")
+
+        server_out = ["search: client1", "search: client2", "search: client3"]
+        clients_out = {
+            "client1": ["search: client1: The quick brown fox", "search: 1 results"],
+            "client2": ["search: client3: Quick lunch?",
+                        "search: client1: The quick brown fox", "search: 2 results"],
+            "client3": ["search: 0 results",
+                        "search: client1: The quick brown fox", "search: 1 results"],
+        }
+
+        for client in self.client_stdin.keys():
+            server_out.append("join: %s" % client)
+            clients_out[client].append("quitting")
+            server_out.append('disconnected: %s' % client)
+
+        # Checking Clients Output, newest results first
+        for client in clients_out.keys():
+            with open("client_" + client) as f:
+                lines = f.read().split('\n')
+                for each_line in clients_out[client]:
+                    if each_line not in lines:
+                        print("Test Failed: Client output is not correct", each_line)
+                        return False
+                if client == "client2" and lines.index(clients_out[client][0]) > \
+                        lines.index(clients_out[client][1]):
+                    print("Test Failed: Search results are not ordered by recency")
+                    return False
+                if "search: client2: A lazy dog" in lines and client == "client3":
+                    print("Test Failed: Client found a message it did not receive")
+                    return False
+
+        # Checking Sever Output in File
+        with open("server_out") as f:
+            lines = f.read().split("\n")
+            for each_line in server_out:
+                if each_line not in lines:
+                    print("Test Failed: Server Output is not correct", each_line)
+                    return False
+
+        print("Test Passed")
+        return True
@@ -0,0 +1,198 @@
+'''
+Recordings of the protocol traffic between clients and the server, for
+replaying them against any server implementation with
+Benchmarks/replay.py.
+
+A capture file is JSON lines. The first line holds the arguments the
+server ran with, every further line one read from a connection:
+    {"t": seconds since the capture started, "conn": connection name,
+     "from": "client" or "server", "data": the bytes, base64 encoded}
+
+The test harness writes one capture per test with
+    python3 TestChatApp.py --capture=DIR
+and running this module records real traffic as a proxy in front of a
+server, until interrupted:
+    python3 capture.py -p 15000 -s localhost:15001 -o session.capture
+'''
+import base64
+import getopt
+import json
+import socket
+import sys
+import time
+from threading import Lock, Thread
+
+import util
+
+
+def save(path, records, server_args=()):
+    '''
+    Writes (time, conn, side, data) records to a capture file
+    '''
+    with open(path, "w", encoding="UTF-8") as file:
+        file.write(json.dumps({"server_args": list(server_args)}) + "\n")
+
+        for (stamp, conn, side, data) in records:
+            file.write(json.dumps({
+                "t": round(stamp, 6), "conn": conn, "from": side,
+                "data": base64.b64encode(data).decode("ascii")}) + "\n")
+
+
+def load(path):
+    '''
+    Returns the server arguments and the (time, conn, side, data) records
+    of a capture file
+    '''
+    with open(path, encoding="UTF-8") as file:
+        header = json.loads(file.readline())
+        records = []
+
+        for line in file:
+            record = json.loads(line)
+            records.append((record["t"], record["conn"], record["from"],
+                            base64.b64decode(record["data"])))
+
+    return header["server_args"], records
+
+
+class FrameReader:
+    '''
+    Splits a byte stream into the messages of its frames, reads may end
+    anywhere in a frame
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data) -> list:
+        '''
+        Adds data read from the stream, returns the messages it completed
+        '''
+        self.buffer += data
+        messages = []
+        pos = 0
+
+        while len(self.buffer) - pos >= util.FRAME_HEADER.size:
+            (size, ) = util.FRAME_HEADER.unpack_from(self.buffer, pos)
+            start = pos + util.FRAME_HEADER.size
+
+            # the trace id is not part of the message
+            if size & util.TRACE_FLAG:
+                size &= ~util.TRACE_FLAG
+                start += util.TRACE_ID.size
+
+            if len(self.buffer) < start + size:
+                break
+
+            messages.append(bytes(self.buffer[start:start + size]))
+            pos = start + size
+
+        del self.buffer[:pos]
+
+        return messages
+
+
+class Recorder:
+    '''
+    Proxy that relays every connection to the server and records what
+    passes in both directions
+    '''
+
+    def __init__(self, port, server_addr):
+        self.server_addr = server_addr
+        self.sock = socket.create_server(("", port))
+        self.records = []
+        self.lock = Lock()
+        self.start = time.monotonic()
+
+    def run(self):
+        '''
+        Accepts clients until interrupted
+        '''
+        count = 0
+
+        while True:
+            (client, _) = self.sock.accept()
+            server = socket.create_connection(self.server_addr)
+            util.tune_socket(client)
+            util.tune_socket(server)
+            count += 1
+
+            for (source, target, side) in ((client, server, "client"),
+                                           (server, client, "server")):
+                Thread(target=self.relay, daemon=True,
+                       args=(source, target, f"conn{count}", side)).start()
+
+    def relay(self, source, target, conn, side):
+        '''
+        Copies one direction of a connection until either end closes it
+        '''
+        while True:
+            try:
+                data = source.recv(65536)
+            except OSError:
+                data = b""
+
+            if not data:
+                break
+
+            with self.lock:
+                self.records.append((time.monotonic() - self.start, conn, side, data))
+
+            try:
+                target.sendall(data)
+            except OSError:
+                break
+
+        for sock in (source, target):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    def helper():
+        '''
+        This function is just for the sake of our module completion
+        '''
+        print("Records the traffic between clients and a server")
+        print("-p PORT | --port=PORT Port the clients connect to, defaults to 15000")
+        print("-s HOST:PORT | --server=HOST:PORT Server to relay to, defaults to localhost:15001")
+        print("-o FILE | --output=FILE Capture file written on Ctrl-C, defaults to server.capture")
+        print("-a ARGS | --server-args=ARGS Arguments the server runs with, replayed servers get them")
+        print("-h | --help Print this help")
+
+    try:
+        OPTS, ARGS = getopt.getopt(sys.argv[1:], "p:s:o:a:h",
+                                   ["port=", "server=", "output=", "server-args=", "help"])
+    except getopt.GetoptError:
+        helper()
+        sys.exit(1)
+
+    PORT = 15000
+    SERVER_ADDR = ("localhost", 15001)
+    OUTPUT = "server.capture"
+    SERVER_ARGS = []
+    for o, a in OPTS:
+        if o in ("-p", "--port"):
+            PORT = int(a)
+        elif o in ("-s", "--server"):
+            HOST, _, SERVER_PORT = a.rpartition(":")
+            SERVER_ADDR = (HOST or "localhost", int(SERVER_PORT))
+        elif o in ("-o", "--output"):
+            OUTPUT = a
+        elif o in ("-a", "--server-args"):
+            SERVER_ARGS = a.split()
+        elif o in ("-h", "--help"):
+            helper()
+            sys.exit(0)
+
+    RECORDER = Recorder(PORT, SERVER_ADDR)
+
+    try:
+        RECORDER.run()
+    except KeyboardInterrupt:
+        with RECORDER.lock:
+            save(OUTPUT, RECORDER.records, SERVER_ARGS)
+        print(f"{len(RECORDER.records)} records written to {OUTPUT}")
@@ -3,140 +3,637 @@ This module defines the behaviour of a client in your Chat Application
 '''
 import sys
 import getopt
-import socket
-from threading import Thread
+import asyncio
+import signal
+from bisect import bisect_left
+from collections import namedtuple
 from pathlib import Path
+from tracing import Tracer
 import util
 
 
 '''
-Write your code inside this class.
-In the start() function, you will read user-input and act accordingly.
-receive_handler() function is running another thread and you have to listen
-for incoming messages in this function.
+AsyncClient is the importable client core. It owns the connection to the
+server and turns incoming messages into Events, so many clients can run in
+one event loop (bots, load tools).
+Client is the command line interface and is a thin wrapper around it: it
+reads user-input without blocking the loop and prints the events.
 '''
 
 
-class Client:
+# type is one of "msg", "file", "channel", "list", "search" or "error".
+# target is the filename of a "file" event, the channel of a "channel"
+# event and the send time (seconds since the epoch) of a "search" result.
+# data is the message text, the file contents, the list of usernames or the
+# error code. trace_id is set when the message was traced.
+Event = namedtuple("Event", ["type", "sender", "target", "data", "trace_id"],
+                   defaults=[0])
+
+
+def roster_key(username):
     '''
-    This is the main Client Class.
+    Case-insensitive sort key that still orders names differing only in case
+    '''
+    return (username.lower(), username)
+
+
+class AsyncClient:
+    '''
+    asyncio client core with a programmatic API
     '''
 
-    def __init__(self, username, dest, port):
+    # bulk connections get large socket buffers from the start, see util.tune_socket
+    bulk = False
+
+    def __init__(self, username, dest, port, tracer=None):
         self.server_addr = dest
         self.server_port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(None)
         self.name = username
+        self.tracer = tracer
+        self.trace_id = 0
+
+        self.reader = None
+        self.writer = None
+        self.receiver_task = None
+        self.event_queue = asyncio.Queue()
+        self.list_waiters = []
+        self.search_waiters = []  # (future, results so far)
+        self.closed = False
+
+        # Local roster kept up to date by presence deltas once subscribed.
+        # None means the client is not subscribed and list_users asks the server.
+        self.roster = None
+        self.presence_seq = 0
+
+    async def connect(self):
+        '''
+        Opens the connection to the server and starts receiving messages
+        '''
+        self.reader, self.writer = await asyncio.open_connection(
+            self.server_addr, self.server_port)
+        util.tune_socket(self.writer.get_extra_info("socket"), self.bulk)
+        self.receiver_task = asyncio.create_task(self.receive_handler())
 
-        self.is_alive = True
+    async def join(self):
+        '''
+        Sends the JOIN message
+        '''
+        await self.send("join", 1, self.name)
 
-        try:
-            self.sock.connect((self.server_addr, self.server_port))
-        except ConnectionRefusedError:
-            self.shutdown()
+    async def send_message(self, usernames, message):
+        '''
+        Sends a text message to the given usernames
+        '''
+        await self.send("send_message", 4, " ".join(
+            [str(len(usernames))] + list(usernames) + [message]))
 
-    def start(self):
+    async def send_file(self, usernames, path):
         '''
-        Main Loop is here
-        Start by sending the server a JOIN message.
-        Waits for userinput and then process it
+        Sends a utf-8 text file to the given usernames
         '''
-        self.send_message("join", 1, self.name)
+        path = Path(path)
+        data = await asyncio.to_thread(path.read_text, encoding="UTF-8")
 
-        while True:
-            in_str = input().split(" ")
+        if len(data) >= util.BULK_FRAME_SIZE and self.writer and not self.bulk:
+            self.bulk = True
+            util.tune_socket(self.writer.get_extra_info("socket"), bulk=True)
 
-            if not self.is_alive:
-                sys.exit()
+        await self.send("send_file", 4, " ".join(
+            [str(len(usernames))] + list(usernames) + [path.name, data]))
 
-            if in_str[0] == "msg":
-                self.send_message("send_message", 4, " ".join(in_str[1:]))
+    async def list_users(self):
+        '''
+        Returns the sorted list of connected usernames.
+        Answered from the local roster when subscribed to presence.
+        '''
+        if self.roster is not None:
+            return list(self.roster)
 
-            elif in_str[0] == "list":
-                self.send_message("request_users_list", 2)
+        waiter = asyncio.get_running_loop().create_future()
+        self.list_waiters.append(waiter)
+        await self.send("request_users_list", 2)
 
-            elif in_str[0] == "file":
-                file = Path(in_str[-1])
+        return await waiter
 
-                if file.is_file():
-                    with open(file, "rt", encoding='UTF-8') as file:
-                        data = file.read()
+    async def subscribe_presence(self):
+        '''
+        Asks the server for a roster snapshot followed by presence deltas
+        '''
+        await self.send("subscribe_presence", 2)
 
-                    self.send_message("send_file", 4, " ".join(
-                        in_str[1:-1]) + " " + file.name + " " + data)
-                else:
-                    print("Incorrect file path")
+    async def create_channel(self, channel):
+        '''
+        Creates a channel, the creator becomes its first member
+        '''
+        await self.send("create_channel", 1, channel)
 
-            elif in_str[0] == "help":
-                self.print_help()
+    async def join_channel(self, channel):
+        '''
+        Joins an existing channel
+        '''
+        await self.send("join_channel", 1, channel)
 
-            elif in_str[0] == "quit":
-                self.shutdown(prompt_server=True)
+    async def leave_channel(self, channel):
+        '''
+        Leaves a channel
+        '''
+        await self.send("leave_channel", 1, channel)
 
-            else:
-                print("incorrect userinput format")
+    async def post(self, channel, message):
+        '''
+        Sends a message to every member of a channel
+        '''
+        await self.send("send_channel_message", 4, channel + " " + message)
 
-    def receive_handler(self):
+    async def search(self, text):
         '''
-        Waits for a message from server and process it accordingly
+        Returns "search" Events of the newest messages this user sent or
+        received that contain every word of text, newest first
+        '''
+        waiter = asyncio.get_running_loop().create_future()
+        self.search_waiters.append((waiter, []))
+        await self.send("search", 4, text)
+
+        return await waiter
+
+    async def events(self):
+        '''
+        Async iterator over incoming Events, ends when the connection closes
         '''
         while True:
-            try:
-                recv_str = self.receive_message()
-            except (ConnectionAbortedError, ConnectionResetError):
-                self.is_alive = False
+            event = await self.event_queue.get()
+
+            if event is None:
                 return
 
-            if recv_str[0] == "ERR_SERVER_FULL":
-                print("disconnected: server full")
-                break
+            yield event
+
+    async def close(self, prompt_server=True):
+        '''
+        Closes the connection, telling the server first if prompt_server
+        '''
+        if self.writer is None:
+            return
+
+        if prompt_server and not self.writer.is_closing():
+            try:
+                await self.send("disconnect", 1, self.name)
+            except ConnectionError:
+                pass
+
+        self.writer.close()
+
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
 
-            elif recv_str[0] == "ERR_USERNAME_UNAVAILABLE":
-                print("disconnected: username not available")
-                break
+    async def send(self, msg_type, msg_format, message=None):
+        '''
+        Send message to server
+        '''
+        send_str = util.make_message(msg_type, msg_format, message)
+        await self.send_frame(send_str.encode("utf-8"))
 
-            elif recv_str[0] == "err_unknown_message":
-                print("disconnected: server received an unknown command")
-                break
+    async def send_frame(self, data):
+        '''
+        Sends an encoded message as one frame
+        '''
+        if not self.tracer:
+            self.writer.write(util.pack_frame(data))
+            await self.writer.drain()
+            return
+
+        trace_id = self.tracer.new_trace_id()
+        self.tracer.record(trace_id, "client_encode")
+        self.writer.write(util.pack_frame(data, trace_id))
+        await self.writer.drain()
+        self.tracer.record(trace_id, "client_send")
+
+    async def receive_message(self):
+        '''
+        Receive message from server.
+        The trace id of a traced message is kept in self.trace_id.
+        '''
+        header = await self.reader.readexactly(util.FRAME_HEADER.size)
+        (size,) = util.FRAME_HEADER.unpack(header)
+        self.trace_id = 0
+
+        if size & util.TRACE_FLAG:
+            size &= ~util.TRACE_FLAG
+            (self.trace_id,) = util.TRACE_ID.unpack(
+                await self.reader.readexactly(util.TRACE_ID.size))
 
-            elif recv_str[0] == "forward_message":
-                sender_username = recv_str[1]
-                message = " ".join(recv_str[2:])
-                print(f"msg: {sender_username}: {message}")
+        data = await self.reader.readexactly(size)
 
-            elif recv_str[0] == "forward_file":
-                sender_username = recv_str[1]
-                filename = recv_str[2]
-                data = " ".join(recv_str[3:])
+        if self.tracer and self.trace_id:
+            self.tracer.record(self.trace_id, "client_recv")
 
-                print(f"file: {sender_username}: {filename}")
+        return data.decode().split(" ")
 
-                with open(self.name+"_"+filename, "w", encoding="UTF-8") as file:
-                    file.write(data)
+    async def receive_handler(self):
+        '''
+        Waits for messages from server and turns them into Events
+        '''
+        try:
+            while True:
+                recv_str = await self.receive_message()
+
+                if not self.dispatch(recv_str):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionAbortedError,
+                ConnectionResetError):
+            pass
+        finally:
+            self.end_events()
+
+    def dispatch(self, recv_str):
+        '''
+        Processes a message, returns False once the server dropped the client
+        '''
+        if recv_str[0] in ["ERR_SERVER_FULL", "ERR_SERVER_BUSY",
+                           "ERR_USERNAME_UNAVAILABLE", "ERR_GATEWAY_DENIED",
+                           "err_unknown_message"]:
+            self.event_queue.put_nowait(Event("error", None, None, recv_str[0]))
+            return False
 
-            elif recv_str[0] == "RESPONSE_USERS_LIST":
-                usernames_str = " ".join(sorted(recv_str[1:], key=str.lower))
-                print(f"list: {usernames_str}")
+        self.handle_message(recv_str)
 
+        return True
+
+    def end_events(self):
+        '''
+        Ends the events iterator and fails pending list and search requests
+        '''
+        for waiter in self.list_waiters + [waiter for waiter, _ in self.search_waiters]:
+            if not waiter.done():
+                waiter.cancel()
+        self.list_waiters = []
+        self.search_waiters = []
+
+        if not self.closed:
+            self.closed = True
+            self.event_queue.put_nowait(None)
+
+    def handle_message(self, recv_str):
+        '''
+        Processes a single message received from the server
+        '''
+        if recv_str[0] == "forward_message":
+            self.event_queue.put_nowait(Event(
+                "msg", recv_str[1], None, " ".join(recv_str[2:]), self.trace_id))
+
+        elif recv_str[0] == "forward_file":
+            self.event_queue.put_nowait(Event(
+                "file", recv_str[1], recv_str[2], " ".join(recv_str[3:]), self.trace_id))
+
+        elif recv_str[0] == "forward_channel_message":
+            self.event_queue.put_nowait(Event(
+                "channel", recv_str[2], recv_str[1], " ".join(recv_str[3:]), self.trace_id))
+
+        elif recv_str[0] == "RESPONSE_USERS_LIST":
+            usernames = sorted(filter(None, recv_str[1:]), key=roster_key)
+
+            if self.list_waiters:
+                self.list_waiters.pop(0).set_result(usernames)
             else:
+                self.event_queue.put_nowait(
+                    Event("list", None, None, usernames))
+
+        elif recv_str[0] == "search_result" and self.search_waiters:
+            self.search_waiters[0][1].append(Event(
+                "search", recv_str[2], float(recv_str[1]), " ".join(recv_str[3:])))
+
+        elif recv_str[0] == "search_end" and self.search_waiters:
+            waiter, results = self.search_waiters.pop(0)
+            waiter.set_result(results)
+
+        elif recv_str[0] == "presence_snapshot":
+            self.presence_seq = int(recv_str[1])
+            self.roster = sorted(filter(None, recv_str[2:]), key=roster_key)
+
+        elif recv_str[0] == "presence_delta":
+            self.apply_presence_delta(int(recv_str[1]), recv_str[2:])
+
+    def apply_presence_delta(self, seq, changes):
+        '''
+        Applies "+username"/"-username" changes to the local roster.
+        A gap in the sequence numbers means deltas were missed, so the
+        client drops the roster and resubscribes for a fresh snapshot.
+        '''
+        if self.roster is None:
+            return
+
+        if seq != self.presence_seq + 1:
+            self.roster = None
+            asyncio.create_task(self.subscribe_presence())
+            return
+
+        self.presence_seq = seq
+
+        for change in changes:
+            username = change[1:]
+            index = bisect_left(
+                self.roster, roster_key(username), key=roster_key)
+            present = index < len(self.roster) and self.roster[index] == username
+
+            if change[0] == "+" and not present:
+                self.roster.insert(index, username)
+            elif change[0] == "-" and present:
+                del self.roster[index]
+
+
+class GatewaySession(AsyncClient):
+    '''
+    A user session multiplexed over an AsyncGateway connection.
+    Has the same API as AsyncClient.
+    '''
+
+    def __init__(self, gateway, session_id, username):
+        super().__init__(username, gateway.server_addr,
+                         gateway.server_port, gateway.tracer)
+        self.gateway = gateway
+        self.session_id = session_id
+        self.prefix = f"session {session_id} ".encode("utf-8")
+
+    async def connect(self):
+        '''
+        Attaches the session to its gateway, which must already be connected
+        '''
+        self.gateway.sessions[self.session_id] = self
+
+    async def join(self):
+        '''
+        Opens the session on the server
+        '''
+        await self.gateway.send("open_session", 4, f"{self.session_id} {self.name}")
+
+    async def send_frame(self, data):
+        '''
+        Tags the message with the session id and sends it through the gateway
+        '''
+        await self.gateway.send_frame(self.prefix + data)
+
+    async def close(self, prompt_server=True):
+        '''
+        Closes the session, the gateway connection stays open
+        '''
+        if self.gateway.sessions.pop(self.session_id, None) and prompt_server:
+            try:
+                await self.send("disconnect", 1, self.name)
+            except ConnectionError:
                 pass
 
-        self.is_alive = False
-        self.shutdown()
+        self.end_events()
+
 
-    def send_message(self, msg_type, msg_format, message=None):
+class AsyncGateway(AsyncClient):
+    '''
+    One authenticated connection carrying many user sessions.
+    Its own events() only reports errors of the gateway connection.
+    '''
+
+    bulk = True
+
+    def __init__(self, name, token, dest, port, tracer=None):
+        super().__init__(name, dest, port, tracer)
+        self.token = token
+        self.sessions = {}  # session id => GatewaySession
+        self.next_session_id = 0
+
+    async def join(self):
         '''
-        Send message to server
+        Authenticates the gateway
         '''
-        send_str = util.make_message(msg_type, msg_format, message)
-        self.sock.send(send_str.encode("utf-8"))
+        await self.send("join_gateway", 4, f"{self.name} {self.token}")
+
+    def session(self, username):
+        '''
+        Returns a new session for username, call connect and join on it
+        '''
+        self.next_session_id += 1
+
+        return GatewaySession(self, str(self.next_session_id), username)
+
+    def dispatch(self, recv_str):
+        '''
+        Routes session messages to their GatewaySession
+        '''
+        if recv_str[0] != "session" or len(recv_str) < 3:
+            return super().dispatch(recv_str)
+
+        session = self.sessions.get(recv_str[1])
+
+        if session:
+            session.trace_id = self.trace_id
+
+        if session and not session.dispatch(recv_str[2:]):
+            del self.sessions[recv_str[1]]
+            session.end_events()
+
+        return True
+
+    def end_events(self):
+        '''
+        Ends the events of the gateway and of all of its sessions
+        '''
+        for session in list(self.sessions.values()):
+            session.end_events()
+        self.sessions = {}
+
+        super().end_events()
+
+
+class GatewayPool:
+    '''
+    Spreads user sessions over a few gateway connections
+    '''
+
+    def __init__(self, name, token, dest, port, size=4, tracer=None):
+        self.gateways = [AsyncGateway(f"{name}{i}", token, dest, port, tracer)
+                         for i in range(size)]
+
+    async def connect(self):
+        '''
+        Connects and authenticates every gateway of the pool
+        '''
+        for gateway in self.gateways:
+            await gateway.connect()
+            await gateway.join()
 
-    def receive_message(self):
+    def session(self, username):
         '''
-        Receive message from server
+        Returns a new session on the least loaded gateway
         '''
-        return self.sock.recv(10240).decode().split(" ")
+        gateway = min(self.gateways, key=lambda gateway: len(gateway.sessions))
+
+        return gateway.session(username)
+
+    async def close(self):
+        '''
+        Closes every gateway and with them all of their sessions
+        '''
+        for gateway in self.gateways:
+            await gateway.close()
+
+
+class Client:
+    '''
+    This is the main Client Class.
+    '''
+
+    def __init__(self, username, dest, port, trace_path=None):
+        self.name = username
+        self.tracer = Tracer(trace_path) if trace_path else None
+        self.core = AsyncClient(username, dest, port, self.tracer)
+
+    def start(self):
+        '''
+        Runs the client until the user quits or the server disconnects
+        '''
+        asyncio.run(self.run())
+
+    async def run(self):
+        '''
+        Main Loop is here
+        Start by sending the server a JOIN message.
+        Then handles user-input and incoming events side by side
+        '''
+        try:
+            await self.core.connect()
+        except ConnectionRefusedError:
+            print("quitting")
+            return
+
+        await self.core.join()
+
+        if self.tracer:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, self.tracer.dump)
+
+        input_task = asyncio.create_task(self.input_handler())
+        receive_task = asyncio.create_task(self.receive_handler())
+
+        await asyncio.wait([input_task, receive_task],
+                           return_when=asyncio.FIRST_COMPLETED)
+
+        for task in [input_task, receive_task]:
+            task.cancel()
+
+        await self.core.close(prompt_server=input_task.done())
+
+        if self.tracer:
+            self.tracer.dump()
+
+        print("quitting")
+
+    async def read_lines(self):
+        '''
+        Yields lines of user-input without blocking the event loop
+        '''
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+
+        try:
+            await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        except (ValueError, OSError):
+            # stdin is a regular file, which the event loop cannot poll
+            reader = None
+
+        while True:
+            if reader is None:
+                line = await asyncio.to_thread(sys.stdin.readline)
+            else:
+                line = (await reader.readline()).decode()
+
+            if not line:
+                return
+
+            yield line.rstrip("\n")
+
+    async def input_handler(self):
+        '''
+        Waits for userinput and then process it.
+        Returns when the user quits.
+        '''
+        async for line in self.read_lines():
+            in_str = line.split(" ")
+
+            if in_str[0] == "msg" and len(in_str) > 1 and in_str[1].isdigit():
+                num_of_users = int(in_str[1])
+                await self.core.send_message(
+                    in_str[2:2+num_of_users], " ".join(in_str[2+num_of_users:]))
+
+            elif in_str[0] == "list":
+                usernames = await self.core.list_users()
+                print(f"list: {' '.join(usernames)}")
+
+            elif in_str[0] == "presence":
+                await self.core.subscribe_presence()
+
+            elif in_str[0] == "file":
+                file = Path(in_str[-1])
+
+                if len(in_str) > 2 and in_str[1].isdigit() and file.is_file():
+                    await self.core.send_file(in_str[2:-1], file)
+                else:
+                    print("Incorrect file path")
+
+            elif in_str[0] == "channel" and len(in_str) == 3 \
+                    and in_str[1] in ["create", "join", "leave"]:
+                await getattr(self.core, in_str[1] + "_channel")(in_str[2])
+
+            elif in_str[0] == "post" and len(in_str) > 2:
+                await self.core.post(in_str[1], " ".join(in_str[2:]))
+
+            elif in_str[0] == "search" and len(in_str) > 1:
+                results = await self.core.search(" ".join(in_str[1:]))
+
+                for event in results:
+                    print(f"search: {event.sender}: {event.data}")
+                print(f"search: {len(results)} results")
+
+            elif in_str[0] == "help":
+                self.print_help()
+
+            elif in_str[0] == "quit":
+                return
+
+            else:
+                print("incorrect userinput format")
+
+    async def receive_handler(self):
+        '''
+        Prints incoming events until the server disconnects
+        '''
+        async for event in self.core.events():
+            if event.type == "error":
+                print({
+                    "ERR_SERVER_FULL": "disconnected: server full",
+                    "ERR_SERVER_BUSY": "disconnected: server busy",
+                    "ERR_USERNAME_UNAVAILABLE": "disconnected: username not available",
+                    "ERR_GATEWAY_DENIED": "disconnected: gateway denied",
+                    "err_unknown_message": "disconnected: server received an unknown command",
+                }[event.data])
+
+            elif event.type == "msg":
+                print(f"msg: {event.sender}: {event.data}")
+
+            elif event.type == "file":
+                print(f"file: {event.sender}: {event.target}")
+
+                with open(self.name+"_"+event.target, "w", encoding="UTF-8") as file:
+                    file.write(event.data)
+
+            elif event.type == "channel":
+                print(f"channel: {event.target}: {event.sender}: {event.data}")
+
+            elif event.type == "list":
+                print(f"list: {' '.join(event.data)}")
+
+            if self.tracer and event.trace_id:
+                self.tracer.record(event.trace_id, "client_print")
 
     def print_help(self):
         '''
@@ -148,19 +645,16 @@ class Client:
         print(
             "file [num of clients] [clients] [file path]".ljust(50) + "send file to client(s)")
         print("list".ljust(50) + "get list of connected client(s)")
+        print("presence".ljust(50) +
+              "keep a local list of connected client(s) up to date")
+        print("channel [create|join|leave] [channel]".ljust(50) +
+              "manage channel membership")
+        print("post [channel] [message]".ljust(50) +
+              "send message to channel members")
+        print("search [words]".ljust(50) +
+              "find sent and received messages containing the words")
         print("quit".ljust(50) + "shutdown client")
 
-    def shutdown(self, prompt_server=False):
-        '''
-        Shutdown client instance
-        '''
-        if prompt_server:
-            self.send_message("disconnect", 1, self.name)
-            self.sock.close()
-
-        print("quitting")
-        sys.exit()
-
 
 # Do not change this part of code
 if __name__ == "__main__":
@@ -172,10 +666,11 @@ if __name__ == "__main__":
         print("-u username | --user=username The username of Client")
         print("-p PORT | --port=PORT The server port, defaults to 15000")
         print("-a ADDRESS | --address=ADDRESS The server ip or hostname, defaults to localhost")
+        print("-t FILE | --trace=FILE Trace messages and write the records to FILE")
         print("-h | --help Print this help")
     try:
         OPTS, ARGS = getopt.getopt(sys.argv[1:],
-                                   "u:p:a", ["user=", "port=", "address="])
+                                   "u:p:at:", ["user=", "port=", "address=", "trace="])
     except getopt.error:
         helper()
         exit(1)
@@ -183,6 +678,7 @@ if __name__ == "__main__":
     PORT = 15000
     DEST = "localhost"
     USER_NAME = None
+    TRACE_PATH = None
     for o, a in OPTS:
         if o in ("-u", "--user="):
             USER_NAME = a
@@ -190,19 +686,17 @@ if __name__ == "__main__":
             PORT = int(a)
         elif o in ("-a", "--address="):
             DEST = a
+        elif o in ("-t", "--trace"):
+            TRACE_PATH = a
 
     if USER_NAME is None:
         print("Missing Username.")
         helper()
         exit(1)
 
-    S = Client(USER_NAME, DEST, PORT)
+    S = Client(USER_NAME, DEST, PORT, TRACE_PATH)
     try:
-        # Start receiving Messages
-        T = Thread(target=S.receive_handler)
-        T.daemon = True
-        T.start()
-        # Start Client
+        # Start Client, user-input and incoming messages share one event loop
         S.start()
     except (KeyboardInterrupt, SystemExit):
         sys.exit()
@@ -0,0 +1,139 @@
+'''
+Low overhead sampling profiler for the Chat Application server.
+
+A background thread periodically takes the stack of every other thread
+with sys._current_frames() and counts identical stacks. The counts are
+written in the collapsed stack format ("frame;frame;frame count" per line)
+that flame graph tools read, e.g. flamegraph.pl or speedscope.
+
+Running this module summarises a collapsed file:
+    python3 profiler.py server.collapsed
+'''
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    '''
+    Samples the stacks of all threads while it is running
+    '''
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        '''
+        Starts a new capture in a background thread
+        '''
+        if self.running:
+            return
+
+        self.stacks = Counter()
+        self.running = True
+        self.thread = threading.Thread(
+            name="Profiler", target=self.sampler, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stops sampling and writes the samples of the capture
+        '''
+        if not self.running:
+            return
+
+        self.running = False
+        self.thread.join()
+        self.dump()
+
+    def toggle(self):
+        '''
+        Starts sampling if stopped, stops and dumps if running
+        '''
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def sampler(self):
+        '''
+        Sampling loop
+        '''
+        own_ident = threading.get_ident()
+
+        while self.running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident != own_ident:
+                    self.stacks[self.collapse(names.get(ident, "unknown"), frame)] += 1
+
+            time.sleep(self.interval)
+
+    @staticmethod
+    def collapse(thread_name, frame) -> str:
+        '''
+        Formats a stack root first, starting with the thread name
+        '''
+        labels = []
+
+        while frame is not None:
+            code = frame.f_code
+            labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                          f":{code.co_firstlineno})")
+            frame = frame.f_back
+
+        labels.append(thread_name)
+
+        return ";".join(reversed(labels))
+
+    def dump(self):
+        '''
+        Writes the collapsed stacks to the profile file
+        '''
+        with open(self.path, "w", encoding="UTF-8") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def summarise(path, top=15):
+    '''
+    Prints the functions with the most samples, on top of the stack (self)
+    and anywhere in it (total)
+    '''
+    own = Counter()
+    total = Counter()
+    samples = 0
+
+    with open(path, encoding="UTF-8") as file:
+        for line in file:
+            stack, count = line.rsplit(" ", 1)
+            count = int(count)
+            frames = stack.split(";")[1:]
+            samples += count
+
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+
+    print(f"{samples} samples")
+
+    for title, counter in [("self", own), ("total", total)]:
+        print(f"top {top} by {title}:")
+        for frame, count in counter.most_common(top):
+            print(f"  {count * 100 / max(samples, 1):5.1f}% {frame}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 profiler.py COLLAPSED_FILE")
+        sys.exit(1)
+
+    summarise(sys.argv[1])
@@ -0,0 +1,244 @@
+'''
+Full-text search over the message history of the Chat Application.
+
+MessageIndex is an in-memory inverted index: every message gets the next
+integer id, and every word of its text maps to the ascending list of ids
+(its postings) of the messages containing it. Who may see a message is
+indexed the same way, under "@username" keys for its sender and
+recipients, so a search is one intersection of sorted postings that walks
+the shortest list from its newest end.
+
+The oldest messages are evicted beyond a message count, a total length of
+their texts, or an age, so long messages cannot grow it unbounded. Evicted ids
+are cut from the front of the postings when a list is next used, and from
+all of them whenever the message list is compacted.
+
+The index is written to a JSON file at shutdown with the postings delta
+encoded, and read back at startup. Running this module searches a file:
+    python3 search.py server.index alice word [word ...]
+'''
+import json
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from threading import Lock
+
+
+WORD = re.compile(r"\w+")
+
+# Ids of the shortest postings intersected at once by a search, and how
+# many times more ids other postings need in their range to be probed
+# instead of intersected
+CHUNK = 256
+DENSE = 8
+
+
+def words(text) -> set:
+    '''
+    The distinct lowercase words of a text
+    '''
+    return set(WORD.findall(text.lower()))
+
+
+class MessageIndex:
+    '''
+    Inverted index of messages with bounded size
+    '''
+
+    def __init__(self, path, max_messages=1000000, max_age=None,
+                 max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = Lock()
+
+        # (time, sender, text) of message id base + i, evicted entries are None
+        self.messages = []
+        self.base = 0
+        self.head = 0  # index of the oldest live message
+        self.size = 0  # length of the texts of the live messages
+        self.postings = {}  # word or "@username" => array of message ids
+
+    def __len__(self):
+        return len(self.messages) - self.head
+
+    def add(self, sender, recipients, text):
+        '''
+        Indexes a message that sender sent to recipients
+        '''
+        now = time.time()
+
+        with self.lock:
+            message_id = self.base + len(self.messages)
+            self.messages.append((now, sender, text))
+            self.size += len(text)
+
+            keys = words(text)
+            keys.add("@" + sender)
+            keys.update("@" + recipient for recipient in recipients)
+
+            for key in keys:
+                postings = self.postings.get(key)
+
+                if postings is None:
+                    postings = self.postings[key] = array("Q")
+
+                postings.append(message_id)
+
+            self.evict(now)
+
+    def evict(self, now):
+        '''
+        Drops the oldest messages beyond max_messages, max_bytes or max_age
+        '''
+        while len(self) > self.max_messages or self.size > self.max_bytes or (
+                self.max_age is not None and len(self)
+                and self.messages[self.head][0] < now - self.max_age):
+            self.size -= len(self.messages[self.head][2])
+            self.messages[self.head] = None
+            self.head += 1
+
+        if self.head > len(self.messages) // 2:
+            self.compact()
+
+    def compact(self):
+        '''
+        Removes evicted messages and their ids in all postings
+        '''
+        del self.messages[:self.head]
+        self.base += self.head
+        self.head = 0
+
+        for key in list(self.postings):
+            if not self.live(key):
+                del self.postings[key]
+
+    def live(self, key):
+        '''
+        Postings of key without evicted ids
+        '''
+        postings = self.postings.get(key)
+
+        if postings:
+            evicted = bisect_left(postings, self.base + self.head)
+            if evicted:
+                del postings[:evicted]
+
+        return postings
+
+    def search(self, username, text, limit=20) -> list:
+        '''
+        Returns (time, sender, text) of the newest messages sent or received
+        by username that contain every word of text, newest first
+        '''
+        keys = words(text)
+
+        if not keys:
+            return []
+
+        keys.add("@" + username)
+        results = []
+
+        with self.lock:
+            self.evict(time.time())
+
+            lists = []
+            for key in keys:
+                postings = self.live(key)
+                if not postings:
+                    return []
+                lists.append(postings)
+
+            # Walk the shortest postings from the newest end a chunk at a
+            # time. Postings with few ids in the chunk's range are
+            # intersected with it as sets, which keeps the per-id work in C,
+            # dense ones are probed per candidate until enough results match.
+            lists.sort(key=len)
+            shortest, others = lists[0], lists[1:]
+            end = len(shortest)
+
+            while end and len(results) < limit:
+                start = max(end - CHUNK, 0)
+                matches = set(shortest[start:end])
+                low, high = shortest[start], shortest[end - 1]
+                dense = []
+
+                for postings in others:
+                    first = bisect_left(postings, low)
+                    last = bisect_right(postings, high, first)
+
+                    if last - first > DENSE * len(matches):
+                        dense.append((postings, first, last))
+                    else:
+                        matches.intersection_update(postings[first:last])
+
+                for message_id in sorted(matches, reverse=True):
+                    for postings, first, last in dense:
+                        index = bisect_left(postings, message_id, first, last)
+                        if index == last or postings[index] != message_id:
+                            break
+                    else:
+                        results.append(self.messages[message_id - self.base])
+                        if len(results) == limit:
+                            break
+
+                end = start
+
+        return results
+
+    def dump(self):
+        '''
+        Writes the live messages and their delta encoded postings to the
+        index file, with ids renumbered from 0
+        '''
+        with self.lock:
+            first = self.base + self.head
+            postings = {}
+
+            for key in self.postings:
+                ids = self.live(key)
+                if ids:
+                    postings[key] = [ids[0] - first] + \
+                        [later - earlier for earlier, later in zip(ids, ids[1:])]
+
+            state = {"messages": self.messages[self.head:], "postings": postings}
+
+        with open(self.path, "w", encoding="UTF-8") as file:
+            json.dump(state, file, separators=(",", ":"))
+
+    def load(self):
+        '''
+        Reads the index file written by dump, if there is one
+        '''
+        try:
+            with open(self.path, encoding="UTF-8") as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+
+        with self.lock:
+            self.messages = [tuple(message) for message in state["messages"]]
+            self.base = 0
+            self.head = 0
+            self.size = sum(len(text) for (_, _, text) in self.messages)
+            self.postings = {key: array("Q", accumulate(deltas))
+                             for key, deltas in state["postings"].items()}
+
+            self.evict(time.time())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python3 search.py INDEX_FILE USERNAME WORD [WORD ...]")
+        sys.exit(1)
+
+    INDEX = MessageIndex(sys.argv[1], max_messages=float("inf"),
+                         max_bytes=float("inf"))
+    INDEX.load()
+
+    for TIME, SENDER, TEXT in INDEX.search(sys.argv[2], " ".join(sys.argv[3:])):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(TIME))} {SENDER}: {TEXT}")
@@ -1,32 +1,736 @@
 '''
 This module defines the behaviour of server in your Chat Application
 '''
+import os
 import sys
 import getopt
+import select
+import signal
 import socket
-from threading import Thread
+import time
+from threading import Thread, Lock, Condition
 import util
 
+# Modules that only optional features need (gateways, tracing, profiling,
+# restarts) are imported where they are used, to keep startup fast.
+
+
+class MemoryBudget:
+    '''
+    Bytes the receive buffers of all sessions together may grow beyond
+    their RECV_BUFFER_SIZE
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = Lock()
+
+    def reserve(self, size: int) -> int:
+        '''
+        Takes up to size bytes of the budget, returns how many were granted
+        '''
+        with self.lock:
+            granted = max(min(size, self.limit - self.used), 0)
+            self.used += granted
+
+        return granted
+
+    def release(self, size: int):
+        '''
+        Returns bytes taken with reserve
+        '''
+        with self.lock:
+            self.used -= size
+
+
+MEMORY = MemoryBudget(util.MEMORY_LIMIT)
+
+
+class Admission:
+    '''
+    Admission control for new connections and gateway sessions: the
+    listen backlog, how long a connection may take to join, and load
+    shedding. Joins beyond join_rate per second (a token bucket holding
+    one second's worth) or beyond max_pending unfinished handshakes are
+    refused with ERR_SERVER_BUSY instead of queueing.
+    '''
+
+    def __init__(self, backlog=util.LISTEN_BACKLOG, join_timeout=util.JOIN_TIMEOUT,
+                 join_rate=util.JOIN_RATE, max_pending=util.MAX_PENDING_JOINS):
+        self.backlog = backlog
+        self.join_timeout = join_timeout
+        self.join_rate = join_rate
+        self.max_pending = max_pending
+        self.tokens = max(join_rate, 1)
+        self.refilled = time.monotonic()
+        self.pending = 0
+        self.lock = Lock()
+
+    def take_token(self) -> bool:
+        '''
+        Admits one join if the join rate allows it, the caller holds lock
+        '''
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.refilled) * self.join_rate,
+                          max(self.join_rate, 1))
+        self.refilled = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+
+        return True
+
+    def admit_session(self) -> bool:
+        '''
+        Admits a user joining through a gateway
+        '''
+        with self.lock:
+            return self.take_token()
+
+    def begin_handshake(self) -> bool:
+        '''
+        Admits a new connection, which must call end_handshake once it
+        has joined or failed to
+        '''
+        with self.lock:
+            if self.pending >= self.max_pending or not self.take_token():
+                return False
+
+            self.pending += 1
+
+        return True
+
+    def end_handshake(self):
+        '''
+        Frees the place of a finished handshake
+        '''
+        with self.lock:
+            self.pending -= 1
+
+    def resume_handshake(self):
+        '''
+        Counts a handshake handed over by a restarting server
+        '''
+        with self.lock:
+            self.pending += 1
+
+
+class Handoff:
+    '''
+    Stops every thread that reads from sockets at a frame boundary while
+    the server hands its connections over to a new process, so a frame is
+    never split between the two. Readers wait for data in wait, which
+    parks them while a handoff is requested. A handoff that succeeds ends
+    the process, one that fails resumes them.
+    '''
+
+    def __init__(self):
+        (self.wake_fd, self.notify_fd) = os.pipe()
+        self.requested = False
+        self.readers = 0
+        self.parked = 0
+        self.cond = Condition()
+
+    def enter(self):
+        '''
+        Counts a thread that reads from sockets, it starts reading only
+        after a requested handoff
+        '''
+        with self.cond:
+            while self.requested:
+                self.cond.wait()
+
+            self.readers += 1
+
+    def leave(self):
+        '''
+        Uncounts a reading thread that ends
+        '''
+        with self.cond:
+            self.readers -= 1
+            self.cond.notify_all()
+
+    def wait(self, sock: socket.socket):
+        '''
+        Waits until sock is readable, parked while a handoff is requested.
+        Raises socket.timeout after the timeout of sock.
+        '''
+        timeout = sock.gettimeout()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        poller.register(self.wake_fd, select.POLLIN)
+
+        while True:
+            if self.requested:
+                with self.cond:
+                    self.parked += 1
+                    self.cond.notify_all()
+
+                    while self.requested:
+                        self.cond.wait()
+
+                    self.parked -= 1
+
+            if deadline is None:
+                events = poller.poll()
+            else:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise socket.timeout("timed out")
+                events = poller.poll(left * 1000)
+
+            for (fd, _) in events:
+                if fd != self.wake_fd:
+                    return
+
+    def request(self, timeout) -> bool:
+        '''
+        Parks all readers. Returns False if some are still busy, e.g. in
+        the middle of a frame, after timeout seconds.
+        '''
+        with self.cond:
+            self.requested = True
+            os.write(self.notify_fd, b"H")
+
+            return self.cond.wait_for(lambda: self.parked >= self.readers, timeout)
+
+    def run(self, target, *args):
+        '''
+        Runs target counted as a reader, the target of threads that
+        read from sockets
+        '''
+        self.enter()
+
+        try:
+            target(*args)
+        finally:
+            self.leave()
+
+    def resume(self):
+        '''
+        Lets the parked readers continue after a failed handoff
+        '''
+        os.read(self.wake_fd, 1)
+
+        with self.cond:
+            self.requested = False
+            self.cond.notify_all()
+
+
+HANDOFF = Handoff()
+
+
+class Spill:
+    '''
+    The end of a large frame, received into a temporary file instead of
+    memory. It is sent from the file with sendfile and can be forwarded
+    to any number of recipients. The file is deleted once the last of them
+    drops the Spill.
+    '''
+    __slots__ = ("file", "size")
+
+    def __init__(self, file, size: int):
+        self.file = file
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def send(self, sock: socket.socket) -> int:
+        '''
+        Writes the file to sock, as fast as the peer reads it. A peer that
+        takes nothing for SPILL_SEND_TIMEOUT seconds would hold up the
+        sender for good, so its connection is shut down, the rest of the
+        frame can never follow, and socket.timeout is raised.
+        '''
+        offset = 0
+
+        # sendfile has no timeout of its own, a blocking socket's send
+        # timeout makes it fail instead of waiting
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                        util.TIMEVAL.pack(util.SPILL_SEND_TIMEOUT, 0))
+
+        try:
+            while offset < self.size:
+                try:
+                    offset += os.sendfile(sock.fileno(), self.file.fileno(),
+                                          offset, self.size - offset)
+                except BlockingIOError:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    raise socket.timeout("recipient stopped reading") from None
+        finally:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                            util.TIMEVAL.pack(0, 0))
+
+        return self.size
+
+
+class Session:
+    '''
+    Per-connection state: the socket, the user it belongs to, a receive
+    buffer that is reused for every frame, the outbound queue and counters.
+    '''
+    __slots__ = ("sock", "username", "recv_buf", "recv_pos", "recv_size",
+                 "spill", "trace_id", "outbox", "send_lock", "bulk", "msgs_in",
+                 "msgs_out", "bytes_in", "bytes_out")
+
+    def __init__(self, sock: socket.socket, username=None):
+        self.sock = sock
+        self.username = username
+        self.recv_buf = bytearray(util.RECV_BUFFER_SIZE)
+        self.recv_pos = 0
+        self.recv_size = 0
+        self.spill = None
+        self.trace_id = 0
+        self.outbox = []  # frames, each a tuple of buffers
+        self.send_lock = Lock()
+        self.bulk = False
+        self.msgs_in = 0
+        self.msgs_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def receive_frame(self, max_size=None, deadline=None) -> bool:
+        '''
+        Reads one frame into the receive buffer, its fields are then read
+        with next_field and payload. Returns False if the connection closes
+        or the frame is larger than max_size. Raises socket.timeout if the
+        frame is not complete by deadline, a time.monotonic() value.
+        The buffer grows for a large frame as far as the memory budget
+        allows, up to SPILL_THRESHOLD. The rest of the frame is spilled to
+        a temporary file, see payload_parts.
+        '''
+        # give the memory of a large frame back once it has been handled
+        self.release_buffer()
+        self.spill = None
+
+        if not self.recv_into(util.FRAME_HEADER.size, True, deadline):
+            return False
+
+        (size,) = util.FRAME_HEADER.unpack_from(self.recv_buf)
+        self.trace_id = 0
+
+        if size & util.TRACE_FLAG:
+            size &= ~util.TRACE_FLAG
+
+            if not self.recv_into(util.TRACE_ID.size, deadline=deadline):
+                return False
+
+            (self.trace_id,) = util.TRACE_ID.unpack_from(self.recv_buf)
+
+        if max_size is not None and size > max_size:
+            return False
+
+        if size >= util.BULK_FRAME_SIZE and not self.bulk:
+            self.make_bulk()
+
+        in_memory = min(size, util.SPILL_THRESHOLD)
+
+        if in_memory > len(self.recv_buf):
+            granted = MEMORY.reserve(in_memory - len(self.recv_buf))
+            in_memory = len(self.recv_buf) + granted
+
+            if granted:
+                self.recv_buf = bytearray(in_memory)
+
+        if not self.recv_into(in_memory, deadline=deadline):
+            return False
+
+        if size > in_memory:
+            self.spill = self.receive_spill(size - in_memory)
+
+            if self.spill is None:
+                return False
+
+        self.recv_pos = 0
+        self.recv_size = in_memory
+        self.msgs_in += 1
+        self.bytes_in += util.FRAME_HEADER.size + size
+
+        return True
+
+    def recv_into(self, size: int, boundary=False, deadline=None) -> bool:
+        '''
+        Fills the start of the receive buffer with exactly size bytes.
+        At a frame boundary, waiting for data goes through HANDOFF.
+        '''
+        view = memoryview(self.recv_buf)
+        received = 0
+
+        while received < size:
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise socket.timeout("timed out")
+                self.sock.settimeout(left)
+
+            if boundary and not received:
+                # a socket with a timeout waits in recv despite MSG_DONTWAIT
+                if HANDOFF.requested or self.sock.gettimeout() is not None:
+                    HANDOFF.wait(self.sock)
+                try:
+                    count = self.sock.recv_into(view[:size], 0, socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    HANDOFF.wait(self.sock)
+                    continue
+            else:
+                count = self.sock.recv_into(view[received:size])
+
+            if not count:
+                return False
+
+            received += count
+
+        return True
+
+    def receive_spill(self, size: int) -> Spill:
+        '''
+        Receives size bytes into a temporary file, through a bounded
+        buffer. Returns None if the connection closes first.
+        '''
+        import tempfile
+
+        file = tempfile.TemporaryFile()
+        view = memoryview(bytearray(min(size, util.SPILL_CHUNK)))
+        remaining = size
+
+        while remaining:
+            count = self.sock.recv_into(view[:remaining])
+
+            if not count:
+                file.close()
+                return None
+
+            file.write(view[:count])
+            remaining -= count
+
+        file.flush()
+
+        return Spill(file, size)
+
+    def release_buffer(self):
+        '''
+        Shrinks the receive buffer back to RECV_BUFFER_SIZE
+        '''
+        if len(self.recv_buf) > util.RECV_BUFFER_SIZE:
+            MEMORY.release(len(self.recv_buf) - util.RECV_BUFFER_SIZE)
+            self.recv_buf = bytearray(util.RECV_BUFFER_SIZE)
+
+    def next_field(self) -> str:
+        '''
+        Decodes the next space separated header field of the received
+        message, invalid UTF-8 as U+FFFD. Returns "" once the message is
+        exhausted.
+        '''
+        end = self.recv_buf.find(b" ", self.recv_pos, self.recv_size)
+
+        if end == -1:
+            end = self.recv_size
+
+        field = self.recv_buf[self.recv_pos:end].decode("utf-8", "replace")
+        self.recv_pos = end + 1
+
+        return field
+
+    def payload(self) -> memoryview:
+        '''
+        The rest of the received message, without copying it.
+        Only valid until the next receive_frame call.
+        '''
+        return memoryview(self.recv_buf)[self.recv_pos:self.recv_size]
+
+    def payload_parts(self) -> tuple:
+        '''
+        The rest of the received message for forwarding: the payload and
+        the Spill of a frame too large to be held in memory
+        '''
+        if self.spill:
+            return (self.payload(), self.spill)
+
+        return (self.payload(), )
+
+    def send_frame(self, *parts, trace_id=0):
+        '''
+        Queues a message made of one or more bytes-like parts and sends it.
+        A thread that finds another one writing to the same peer leaves its
+        frame queued, copied since parts may be views into a receive
+        buffer, and the writer sends it with its own in one scatter-gather
+        write. Frames from different threads never interleave.
+        Only small frames are queued this way, and never a Spill, which
+        is released once its message has been forwarded.
+        '''
+        size = sum(len(part) for part in parts)
+        frame = (util.pack_header(size, trace_id), ) + parts
+
+        if size >= util.BULK_FRAME_SIZE and not self.bulk:
+            self.make_bulk()
+
+        if self.send_lock.acquire(blocking=False):
+            self.outbox.append(frame)
+        elif size <= util.COALESCE_MAX_BYTES and len(self.outbox) < util.COALESCE_MAX_FRAMES \
+                and not isinstance(parts[-1], Spill):
+            self.outbox.append(tuple(bytes(part) for part in frame))
+
+            if not self.send_lock.acquire(blocking=False):
+                return
+        else:
+            self.send_lock.acquire()
+            self.outbox.append(frame)
+
+        # a frame queued just before the lock was released has to be sent
+        # by this thread, its sender already gave up on the lock
+        while True:
+            try:
+                self.flush()
+            finally:
+                self.send_lock.release()
+
+            if not self.outbox or not self.send_lock.acquire(blocking=False):
+                return
+
+    def offer_frame(self, *parts) -> bool:
+        '''
+        Sends a message made of bytes parts without ever waiting for the
+        peer or another writer: it is queued behind a writer, or written
+        as far as the socket takes it and the rest left queued for the next
+        write. Returns False, dropping the message, if the queue is full.
+        '''
+        if len(self.outbox) >= util.COALESCE_MAX_FRAMES:
+            return False
+
+        self.outbox.append((util.pack_header(sum(len(part) for part in parts)), ) + parts)
+
+        while self.outbox and self.send_lock.acquire(blocking=False):
+            try:
+                if not self.flush(wait=False):
+                    break
+            finally:
+                self.send_lock.release()
+
+        return True
+
+    def flush(self, wait=True) -> bool:
+        '''
+        Sends the queued frames with scatter-gather writes and their spills
+        with sendfile, the caller holds send_lock. The queue is empty
+        afterwards, also when the write fails. Without wait, it returns
+        False once the socket is full, leaving the unsent rest queued.
+        '''
+        buffers = []
+        flags = 0 if wait else socket.MSG_DONTWAIT
+
+        try:
+            while True:
+                while self.outbox and len(buffers) < util.IOV_MAX:
+                    # an empty part would never count as sent
+                    buffers.extend(part for part in self.outbox.pop(0) if len(part))
+                    self.msgs_out += 1
+
+                if not buffers:
+                    return True
+
+                count = 0
+                for buffer in buffers[:util.IOV_MAX]:
+                    if type(buffer) is Spill:
+                        break
+                    count += 1
+
+                if not count:
+                    self.bytes_out += buffers.pop(0).send(self.sock)
+                    continue
+
+                try:
+                    sent = self.sock.sendmsg(buffers[:count], [], flags)
+                except BlockingIOError:
+                    # only copied frames are queued without wait
+                    self.outbox.insert(0, tuple(buffers))
+                    return False
+                self.bytes_out += sent
+
+                while sent:
+                    size = len(buffers[0])
+
+                    if sent < size:
+                        buffers[0] = memoryview(buffers[0])[sent:]
+                        break
+
+                    sent -= size
+                    del buffers[0]
+        except BaseException:
+            self.outbox.clear()
+            raise
+
+    def make_bulk(self):
+        '''
+        Gives the connection large socket buffers, e.g. for file transfers
+        '''
+        self.bulk = True
+        util.tune_socket(self.sock, bulk=True)
+
+    def close(self):
+        '''
+        Closes the socket and gives back the memory of the receive buffer
+        '''
+        self.sock.close()
+        self.release_buffer()
+        self.spill = None
+
+    def memory_usage(self) -> int:
+        '''
+        Bytes of Python heap held by the session, socket object included
+        '''
+        return (sys.getsizeof(self) + sys.getsizeof(self.sock) +
+                sys.getsizeof(self.recv_buf) + sys.getsizeof(self.outbox) +
+                sum(sys.getsizeof(frame) for frame in list(self.outbox)) +
+                sys.getsizeof(self.send_lock))
+
+
+class Gateway:
+    '''
+    A single connection that carries many multiplexed user sessions
+    '''
+    __slots__ = ("name", "conn", "sessions")
+
+    def __init__(self, name: str, conn: Session):
+        self.name = name
+        self.conn = conn
+        self.sessions = {}  # session id => username
+
+
+class LogicalSession:
+    '''
+    A user session multiplexed over a gateway connection.
+    Stands in for a Session in client_list.
+    '''
+    __slots__ = ("gateway", "username", "prefix")
+
+    def __init__(self, gateway: Gateway, session_id: str, username: str):
+        self.gateway = gateway
+        self.username = username
+        self.prefix = f"session {session_id} ".encode("utf-8")
+
+    def send_frame(self, *parts, trace_id=0):
+        '''
+        Tags the message with the session id and sends it through the gateway
+        '''
+        self.gateway.conn.send_frame(self.prefix, *parts, trace_id=trace_id)
+
+    def offer_frame(self, *parts) -> bool:
+        '''
+        Tags the message with the session id and offers it to the gateway,
+        see Session.offer_frame
+        '''
+        return self.gateway.conn.offer_frame(self.prefix, *parts)
+
+    def close(self):
+        '''
+        The gateway connection outlives its sessions
+        '''
+
+    def memory_usage(self) -> int:
+        '''
+        Bytes of Python heap held by the session, the gateway is shared
+        '''
+        return sys.getsizeof(self) + sys.getsizeof(self.prefix)
+
 
 class Server:
     '''
     This is the main Server Class. You will to write Server code inside this class.
     '''
 
-    def __init__(self, dest, port):
+    def __init__(self, dest, port, gateway_token=None, tracer=None, profiler=None,
+                 index=None, takeover=None, admission=None):
         self.server_addr = dest
         self.server_port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.settimeout(None)
-        self.sock.bind((self.server_addr, self.server_port))
+        self.admission = admission or Admission()
+
+        # Listen first, connections queue in the backlog while the rest of
+        # the server is set up. A restarted server gets the listening
+        # socket from its predecessor instead, see take_over.
+        if takeover is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.settimeout(None)
+            self.sock.bind((self.server_addr, self.server_port))
+            self.sock.listen(self.admission.backlog)
 
         self.client_list = {}
+        self.tracer = tracer
+        self.profiler = profiler
+
+        # Optional search.MessageIndex of the messages relayed between users
+        self.index = index
+
+        # Checking that a username is free and taking it happen under
+        # join_lock, joins run on their own threads.
+        # Gateways only count as one connection against MAX_NUM_CLIENTS,
+        # the sessions they carry are limited by MAX_SESSIONS_PER_GATEWAY
+        self.gateway_token = gateway_token
+        self.gateways = set()
+        self.num_connections = 0
+        self.join_lock = Lock()
+        self.joining = set()  # sessions of connections that have not joined
+
+        # Channel membership is kept by username so it survives reconnects.
+        # channel_conns holds the pre-resolved sockets of the online members
+        # and is rebuilt whenever a member joins, leaves or (dis)connects.
+        # The three are changed by many handler threads, under channel_lock.
+        self.channel_lock = Lock()
+        self.channels = {}
+        self.channel_conns = {}
+        self.user_channels = {}
+
+        # Presence subscribers get one snapshot and then batched deltas.
+        # presence_changes keeps only the last "+"/"-" per username, so a
+        # user that leaves and rejoins inside one window costs one entry.
+        # They are sent under presence_send_lock only, which keeps them in
+        # sequence order without holding up joins on a slow subscriber.
+        self.presence_send_lock = Lock()
+        self.presence_lock = Lock()
+        self.presence_seq = 0
+        self.presence_changes = {}
+        self.presence_subscribers = set()
+
+        # Commands of joined users. Handlers are called with the Session
+        # holding the message, positioned after the command, and the username.
+        self.commands = {
+            "send_message": lambda msg, username: self.manage_messages(msg, username, "message"),
+            "send_file": lambda msg, username: self.manage_messages(msg, username, "file"),
+            "request_users_list": lambda msg, username: self.send_userlist(username),
+            "subscribe_presence": lambda msg, username: self.subscribe_presence(username),
+            "create_channel": self.create_channel,
+            "join_channel": self.join_channel,
+            "leave_channel": self.leave_channel,
+            "send_channel_message": self.post_channel_message,
+            "search": self.search_messages,
+        }
+
+        # commands typed into the server's terminal
+        self.admin_commands = {
+            "stats": self.memory_report,
+            "trace": self.dump_trace,
+            "profile": self.toggle_profiler,
+            "restart": self.restart,
+        }
 
         self.acceptor_thread = Thread(
-            name="Acceptor", target=self.accept_connections, daemon=True)
+            name="Acceptor", target=HANDOFF.run, args=(self.accept_connections, ),
+            daemon=True)
+        self.presence_thread = Thread(
+            name="Presence", target=self.presence_flusher, daemon=True)
 
-        self.sock.listen()
+        if takeover is not None:
+            self.take_over(takeover)
+        elif self.index is not None:
+            self.index.load()
 
     def start(self):
         '''
@@ -36,38 +740,115 @@ class Server:
         # self.accept_connections()
 
         self.acceptor_thread.start()
+        self.presence_thread.start()
+
+        if self.profiler:
+            self.profiler.start()
 
         try:
             while True:
-                input()
+                command = input().strip()
+
+                if command in self.admin_commands:
+                    self.admin_commands[command]()
         except KeyboardInterrupt:
             self.shutdown()
 
     def accept_connections(self):
         '''
-        Accepts incoming connections
+        Accepts incoming connections and starts a thread for the join of
+        each, so a client that is slow to join holds up nobody else.
+        Connections the server has no room for are refused right away.
+        A connection that fails, e.g. one reset before it is refused, is
+        closed and the loop goes on.
         '''
         while True:
-            (conn, _) = self.sock.accept()
-
-            recv_str = self.receive_message(conn)
-            command = recv_str[0]
-            username = recv_str[1]
+            HANDOFF.wait(self.sock)
 
-            if command != "join":
-                conn.close()
+            try:
+                (sock, _) = self.sock.accept()
+            except OSError:
+                # e.g. out of file descriptors, the connection stays queued
+                time.sleep(0.01)
                 continue
 
-            if len(self.client_list) >= util.MAX_NUM_CLIENTS:
-                self.send_error_message(conn, "ERR_SERVER_FULL")
-                print("disconnected: server full")
+            try:
+                util.tune_socket(sock)
+                conn = Session(sock)
 
-            elif username in self.client_list:
-                self.send_error_message(conn, "ERR_USERNAME_UNAVAILABLE")
-                print("disconnected: username not available")
+                if not self.admission.begin_handshake():
+                    self.send_error_message(conn, "ERR_SERVER_BUSY")
+                    print("disconnected: server busy")
+                    continue
 
+                self.start_join(conn)
+            except Exception:
+                sock.close()
+
+    def start_join(self, conn: Session):
+        '''
+        Starts the thread that waits for a new connection to join
+        '''
+        self.joining.add(conn)
+
+        try:
+            Thread(name="Join", target=HANDOFF.run,
+                   args=(self.join_handler, conn), daemon=True).start()
+        except RuntimeError:
+            self.joining.discard(conn)
+            self.admission.end_handshake()
+            raise
+
+    def join_handler(self, conn: Session):
+        '''
+        Waits up to the join timeout for the first message of a connection
+        and adds the client or gateway it joins
+        '''
+        deadline = time.monotonic() + self.admission.join_timeout
+
+        try:
+            # the timeout bounds the whole frame, not every read of it, and
+            # the frame fits the buffer every session starts with, so a
+            # connection takes no memory budget or disk before it has joined
+            if conn.receive_frame(util.MAX_JOIN_FRAME, deadline):
+                command = conn.next_field()
+                username = conn.next_field()
             else:
-                self.add_client(conn, username)
+                command = None
+            conn.sock.settimeout(None)
+        except socket.timeout:
+            command = None
+            print("disconnected: join timed out")
+        except OSError:
+            command = None
+        finally:
+            self.admission.end_handshake()
+            self.joining.discard(conn)
+
+        if command not in ["join", "join_gateway"] or not username:
+            conn.close()
+            return
+
+        try:
+            with self.join_lock:
+                if self.num_connections >= util.MAX_NUM_CLIENTS:
+                    self.send_error_message(conn, "ERR_SERVER_FULL")
+                    print("disconnected: server full")
+
+                elif command == "join_gateway":
+                    self.add_gateway(conn, username, conn.next_field())
+
+                elif username in self.client_list:
+                    self.send_error_message(conn, "ERR_USERNAME_UNAVAILABLE")
+                    print("disconnected: username not available")
+
+                else:
+                    conn.username = username
+                    self.add_client(conn, username)
+        except Exception:
+            # e.g. the connection failed while it was added
+            conn.close()
+            raise
 
     def connection_handler(self, username):
         '''
@@ -77,75 +858,421 @@ class Server:
 
         while True:
             try:
-                recv_str = self.receive_message(conn)
-                command = recv_str[0]
-
-            except ConnectionResetError:
+                command = self.receive_message(conn)
+            except OSError:
                 break
 
-            if command in ["send_message", "send_file"]:
-                self.manage_messages(recv_str, username)
+            if command in [None, "disconnect"]:
+                break
 
-            elif command == "request_users_list":
-                self.send_userlist(username)
+            handler = self.commands.get(command)
 
-            elif command == "disconnect":
-                conn.close()
-                break
+            if handler:
+                # a message that breaks its handler ends the session, which
+                # is then removed like any other
+                try:
+                    handler(conn, username)
+                except Exception:
+                    break
 
+                # an idle session keeps no more than the initial buffer
+                conn.release_buffer()
             else:
                 self.send_error_message(conn, "err_unknown_message")
-                del self.client_list[username]
+                self.remove_client(username)
+                with self.join_lock:
+                    self.num_connections -= 1
+                conn.close()
                 print(f"disconnected: {username} sent unknown command")
                 return
 
-        del self.client_list[username]
+        # the place is free before the client sees the connection close
+        self.remove_client(username)
+        with self.join_lock:
+            self.num_connections -= 1
+        conn.close()
         print(f"disconnected: {username}")
 
-    def send_error_message(self, conn: socket.socket, error: str):
+    def gateway_handler(self, gateway: Gateway):
         '''
-        Send Error messages to client
+        Handles a gateway connection and routes the commands of its sessions.
+        A command that fails ends its session only, the gateway carries on.
         '''
-        self.send_message(conn, error, 2)
-        conn.close()
+        while True:
+            try:
+                command = self.receive_message(gateway.conn)
+            except OSError:
+                break
+
+            if command == "open_session":
+                session_id = gateway.conn.next_field()
+                username = gateway.conn.next_field()
+
+                if session_id and username:
+                    try:
+                        self.open_session(gateway, session_id, username)
+                    except OSError:
+                        break
+
+            elif command == "session":
+                session_id = gateway.conn.next_field()
+                username = gateway.sessions.get(session_id)
 
-    def add_client(self, conn: socket.socket, username: str):
+                if username is None:
+                    # the session was refused or closed, drop what is in flight
+                    continue
+
+                command = gateway.conn.next_field()
+                handler = self.commands.get(command)
+
+                if command == "disconnect":
+                    self.close_session(gateway, session_id)
+                    print(f"disconnected: {username}")
+
+                elif handler:
+                    try:
+                        handler(gateway.conn, username)
+                    except Exception:
+                        self.close_session(gateway, session_id)
+                        print(f"disconnected: {username}")
+
+                    gateway.conn.release_buffer()
+
+                else:
+                    try:
+                        self.send_message(
+                            self.client_list[username], "err_unknown_message", 2)
+                    except OSError:
+                        pass
+                    self.close_session(gateway, session_id)
+                    print(f"disconnected: {username} sent unknown command")
+
+            elif command in [None, "disconnect"]:
+                break
+
+            else:
+                try:
+                    self.send_message(gateway.conn, "err_unknown_message", 2)
+                except OSError:
+                    pass
+                break
+
+        for session_id in list(gateway.sessions):
+            username = gateway.sessions[session_id]
+            self.close_session(gateway, session_id)
+            print(f"disconnected: {username}")
+
+        with self.join_lock:
+            self.gateways.discard(gateway)
+            self.num_connections -= 1
+        gateway.conn.close()
+        print(f"disconnected: gateway {gateway.name}")
+
+    def send_error_message(self, conn: Session, error: str):
+        '''
+        Send Error messages to client and closes its connection. The
+        client may be gone already.
+        '''
+        try:
+            self.send_message(conn, error, 2)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def add_client(self, conn: Session, username: str):
         '''
         Adds cline to the server and starts the connection handler
         '''
+        self.num_connections += 1
+        self.register_user(conn, username)
+
+        Thread(name="Handler", target=HANDOFF.run,
+               args=(self.connection_handler, username), daemon=True).start()
+
+    def register_user(self, conn, username: str):
+        '''
+        Makes a user reachable through conn, a Session or a LogicalSession
+        '''
         print(f"join: {username}")
 
-        self.client_list[username] = conn
+        with self.presence_lock:
+            self.client_list[username] = conn
+            self.presence_changes[username] = "+"
+
+        with self.channel_lock:
+            for channel in self.user_channels.get(username, ()):
+                self.refresh_channel(channel)
+
+    def add_gateway(self, conn: Session, name: str, token: str):
+        '''
+        Authenticates a gateway and starts its handler
+        '''
+        import hmac
+
+        # compare_digest only takes str that is all ASCII
+        if self.gateway_token is None or not hmac.compare_digest(
+                token.encode("utf-8"), self.gateway_token.encode("utf-8")):
+            self.send_error_message(conn, "ERR_GATEWAY_DENIED")
+            print(f"disconnected: gateway {name} denied")
+            return
+
+        print(f"join_gateway: {name}")
+
+        conn.username = name
+        self.start_gateway(Gateway(name, conn))
 
-        Thread(target=self.connection_handler,
-               args=(username, ), daemon=True).start()
+    def start_gateway(self, gateway: Gateway):
+        '''
+        Registers a gateway and starts its handler
+        '''
+        gateway.conn.make_bulk()
+        self.gateways.add(gateway)
+        self.num_connections += 1
+
+        Thread(name="Gateway", target=HANDOFF.run,
+               args=(self.gateway_handler, gateway), daemon=True).start()
+
+    def open_session(self, gateway: Gateway, session_id: str, username: str):
+        '''
+        Joins a user through a gateway
+        '''
+        session = LogicalSession(gateway, session_id, username)
+
+        if not self.admission.admit_session():
+            self.send_message(session, "ERR_SERVER_BUSY", 2)
+            print("disconnected: server busy")
+            return
+
+        with self.join_lock:
+            if len(gateway.sessions) >= util.MAX_SESSIONS_PER_GATEWAY:
+                self.send_message(session, "ERR_SERVER_FULL", 2)
+                print("disconnected: server full")
+
+            elif username in self.client_list or session_id in gateway.sessions:
+                self.send_message(session, "ERR_USERNAME_UNAVAILABLE", 2)
+                print("disconnected: username not available")
+
+            else:
+                gateway.sessions[session_id] = username
+                self.register_user(session, username)
+
+    def close_session(self, gateway: Gateway, session_id: str):
+        '''
+        Removes a user session from its gateway and from the server
+        '''
+        username = gateway.sessions.pop(session_id)
+        self.remove_client(username)
+
+    def remove_client(self, username: str):
+        '''
+        Removes client from the server and from the fan-out of its channels
+        '''
+        with self.presence_lock:
+            del self.client_list[username]
+            self.presence_subscribers.discard(username)
+            self.presence_changes[username] = "-"
 
-    def manage_messages(self, recv_str: list, sender_username: str) -> bool:
+        with self.channel_lock:
+            for channel in self.user_channels.get(username, ()):
+                self.refresh_channel(channel)
+
+    def manage_messages(self, msg: Session, sender_username: str, msg_type: str) -> bool:
         '''
-        Handles send and forward operation for files and messages
+        Handles send and forward operation for files and messages.
+        msg_type is "message" or "file". The payload is forwarded as a view
+        of the sender's receive buffer, with the spill file of a large one,
+        and never copied.
         '''
+        out_msg_type = "msg" if msg_type == "message" else "file"
+
         try:
-            msg_type = recv_str[0].split("_")[-1]
-            out_msg_type = "msg" if msg_type == "message" else "file"
+            num_of_users = int(msg.next_field())
+        except ValueError:
+            return False
 
-            num_of_users = int(recv_str[1])
-            usernames = list(set(recv_str[2:2+num_of_users]))
-            message = " ".join(recv_str[2+num_of_users:])
-        except Exception:
+        if num_of_users < 0:
             return False
 
+        # the count comes from the client, the fields of the message bound it
+        usernames = set()
+        for _ in range(num_of_users):
+            username = msg.next_field()
+            if not username:
+                break
+            usernames.add(username)
+        header = f"forward_{msg_type} {sender_username} ".encode("utf-8")
+        parts = msg.payload_parts()
+        trace_id = msg.trace_id
+        recipients = []
+
+        if self.tracer and trace_id:
+            self.tracer.record(trace_id, "server_parse")
+
         print(f"{out_msg_type}: {sender_username}")
 
+        if self.tracer and trace_id:
+            self.tracer.record(trace_id, "server_fanout")
+
         for username in usernames:
             _conn = self.client_list.get(username)
 
             if _conn:
-                self.send_message(
-                    _conn, f"forward_{msg_type}", 4, sender_username + " " + message)
+                # a recipient that is gone is removed by its own handler
+                try:
+                    _conn.send_frame(header, *parts, trace_id=trace_id)
+                except OSError:
+                    continue
+                recipients.append(username)
+
+                if self.tracer and trace_id:
+                    self.tracer.record(trace_id, "server_send")
             else:
                 print(
                     f"{out_msg_type}: {sender_username} to non-existent user {username}")
 
+        if self.index is not None and msg_type == "message":
+            self.index.add(sender_username, recipients,
+                           str(parts[0], "utf-8", "replace"))
+
+        return True
+
+    def search_messages(self, msg: Session, username: str) -> bool:
+        '''
+        Sends the user the newest messages they sent or received that
+        contain every word of the query, one search_result each, followed
+        by search_end with the number of results
+        '''
+        conn = self.client_list.get(username)
+
+        if not conn:
+            return False
+
+        query = str(msg.payload(), "utf-8", "replace")
+        results = self.index.search(
+            username, query, util.SEARCH_RESULTS) if self.index is not None else []
+
+        print(f"search: {username}")
+
+        for sent, sender, text in results:
+            self.send_message(conn, "search_result", 4, f"{sent:.3f} {sender} {text}")
+
+        self.send_message(conn, "search_end", 1, len(results))
+
+        return True
+
+    def refresh_channel(self, channel: str):
+        '''
+        Rebuilds the pre-resolved connection list of a channel, the caller
+        holds channel_lock. Users may leave client_list meanwhile, their
+        own refresh follows once they are gone.
+        '''
+        conns = (self.client_list.get(username) for username in self.channels[channel])
+        self.channel_conns[channel] = tuple(conn for conn in conns if conn is not None)
+
+    def create_channel(self, msg: Session, username: str) -> bool:
+        '''
+        Creates a channel and makes its creator the first member
+        '''
+        channel = msg.next_field()
+
+        if not channel:
+            return False
+
+        with self.channel_lock:
+            if channel in self.channels:
+                print(f"create_channel: {username} to existing channel {channel}")
+                return False
+
+            print(f"create_channel: {username} {channel}")
+
+            self.channels[channel] = set()
+            self.channel_conns[channel] = ()
+            self.add_member(channel, username)
+
+        return True
+
+    def join_channel(self, msg: Session, username: str) -> bool:
+        '''
+        Adds the user to the member list of a channel
+        '''
+        channel = msg.next_field()
+
+        with self.channel_lock:
+            if channel not in self.channels:
+                print(f"join_channel: {username} to non-existent channel {channel}")
+                return False
+
+            print(f"join_channel: {username} {channel}")
+            self.add_member(channel, username)
+
+        return True
+
+    def add_member(self, channel: str, username: str):
+        '''
+        Adds the user to the channel and to its fan-out, the caller holds
+        channel_lock
+        '''
+        self.channels[channel].add(username)
+        self.user_channels.setdefault(username, set()).add(channel)
+        self.refresh_channel(channel)
+
+    def leave_channel(self, msg: Session, username: str) -> bool:
+        '''
+        Removes the user from the member list of a channel
+        '''
+        channel = msg.next_field()
+
+        with self.channel_lock:
+            if username not in self.channels.get(channel, ()):
+                print(f"leave_channel: {username} from non-joined channel {channel}")
+                return False
+
+            print(f"leave_channel: {username} {channel}")
+
+            self.channels[channel].discard(username)
+            self.user_channels[username].discard(channel)
+            self.refresh_channel(channel)
+
+        return True
+
+    def post_channel_message(self, msg: Session, sender_username: str) -> bool:
+        '''
+        Forwards a message to every online member of a channel
+        '''
+        channel = msg.next_field()
+
+        # the fan-out is sent from a snapshot, outside the lock
+        with self.channel_lock:
+            if channel not in self.channels:
+                print(f"post: {sender_username} to non-existent channel {channel}")
+                return False
+
+            if sender_username not in self.channels[channel]:
+                print(f"post: {sender_username} to non-joined channel {channel}")
+                return False
+
+            conns = self.channel_conns[channel]
+
+        print(f"post: {sender_username} {channel}")
+
+        header = f"forward_channel_message {channel} {sender_username} ".encode(
+            "utf-8")
+        parts = msg.payload_parts()
+        trace_id = msg.trace_id
+
+        if self.tracer and trace_id:
+            self.tracer.record(trace_id, "server_fanout")
+
+        for _conn in conns:
+            try:
+                _conn.send_frame(header, *parts, trace_id=trace_id)
+            except OSError:
+                pass
+
+        if self.tracer and trace_id:
+            self.tracer.record(trace_id, "server_send")
+
         return True
 
     def send_userlist(self, username: str) -> bool:
@@ -165,18 +1292,320 @@ class Server:
 
         return True
 
-    def send_message(self, conn: socket.socket, msg_type: str, msg_format: int, message=None):
+    def subscribe_presence(self, username: str) -> bool:
+        '''
+        Sends a roster snapshot and subscribes the user to presence deltas.
+        Also used by clients to resync after a sequence gap.
+        '''
+        conn = self.client_list.get(username)
+
+        if not conn:
+            return False
+
+        print(f"subscribe_presence: {username}")
+
+        with self.presence_send_lock:
+            with self.presence_lock:
+                self.presence_subscribers.add(username)
+                roster = " ".join([str(self.presence_seq)] + list(self.client_list))
+
+            send_str = util.make_message("presence_snapshot", 4, roster)
+
+            if not conn.offer_frame(send_str.encode("utf-8")):
+                # without the snapshot, deltas would be of no use
+                with self.presence_lock:
+                    self.presence_subscribers.discard(username)
+                return False
+
+        return True
+
+    def presence_flusher(self):
+        '''
+        Pushes the presence changes of every batch window to subscribers
+        '''
+        while True:
+            time.sleep(util.PRESENCE_BATCH_WINDOW)
+
+            if not self.presence_changes:
+                continue
+
+            with self.presence_send_lock:
+                with self.presence_lock:
+                    changes, self.presence_changes = self.presence_changes, {}
+                    self.presence_seq += 1
+
+                    delta = " ".join(op + username for username,
+                                     op in changes.items())
+                    send_str = util.make_message(
+                        "presence_delta", 4, f"{self.presence_seq} {delta}")
+                    conns = [self.client_list[username]
+                             for username in self.presence_subscribers
+                             if username in self.client_list]
+
+                # A subscriber too slow to take its queued frames misses the
+                # delta instead of holding up the others, the gap in the
+                # sequence numbers makes it resubscribe.
+                frame = send_str.encode("utf-8")
+                for _conn in conns:
+                    try:
+                        _conn.offer_frame(frame)
+                    except OSError:
+                        pass
+
+    def send_message(self, conn: Session, msg_type: str, msg_format: int, message=None):
         '''
         Function to send message to a specific conn
         '''
         send_str = util.make_message(msg_type, msg_format, message)
-        conn.send(send_str.encode("utf-8"))
+        conn.send_frame(send_str.encode("utf-8"))
+
+    def receive_message(self, conn: Session) -> str:
+        '''
+        Receive message from a specific conn and return its command.
+        The other fields are then read from conn. Returns None once the
+        connection is closed.
+        '''
+        if not conn.receive_frame():
+            return None
+
+        if self.tracer and conn.trace_id:
+            self.tracer.record(conn.trace_id, "server_recv")
 
-    def receive_message(self, conn: socket.socket, buffsize=10240) -> list:
+        return conn.next_field()
+
+    def memory_report(self):
         '''
-        Receive message from a specific conn
+        Prints the Python heap held per session, and by the threads that
+        serve direct clients and gateways
         '''
-        return conn.recv(buffsize).decode().split(" ")
+        with self.presence_lock:
+            sessions = list(self.client_list.values())
+        with self.join_lock:
+            sessions += [gateway.conn for gateway in self.gateways]
+
+        total = sum(session.memory_usage() for session in sessions)
+        threads = sum(isinstance(session, Session) for session in sessions)
+        thread_total = threads * util.HANDLER_THREAD_MEMORY
+
+        print(f"memory: {len(sessions)} sessions, {total} bytes, "
+              f"{total // max(len(sessions), 1)} bytes/session")
+        print(f"memory: {threads} handler threads, about {thread_total} bytes, "
+              f"{(total + thread_total) // max(len(sessions), 1)} bytes/session "
+              f"with them")
+        print(f"memory: receive buffers {MEMORY.used} of {MEMORY.limit} bytes above base")
+
+        if self.index is not None:
+            print(f"memory: search index {len(self.index)} messages, "
+                  f"{self.index.size} bytes of text, {len(self.index.postings)} keys")
+
+        for session in sessions:
+            print(f"memory: {session.username} {session.memory_usage()} bytes")
+
+    def dump_trace(self):
+        '''
+        Writes the buffered trace records to the trace file
+        '''
+        if self.tracer:
+            self.tracer.dump()
+
+    def toggle_profiler(self):
+        '''
+        Starts or stops sampling, the profile is written when it stops
+        '''
+        if self.profiler:
+            self.profiler.toggle()
+            print(f"profile: {'on' if self.profiler.running else 'off'}")
+
+    def restart(self):
+        '''
+        Hands the listening socket and every live session over to a new
+        server process, which keeps serving them, and exits. Reading and
+        accepting stop at a frame boundary first, so no message is lost or
+        split. The file descriptors are passed over a Unix socket with
+        SCM_RIGHTS along with a snapshot of the registry.
+        '''
+        import json
+        import subprocess
+        import tempfile
+
+        if not HANDOFF.request(util.HANDOFF_TIMEOUT):
+            HANDOFF.resume()
+            print("restart: connections busy")
+            return
+
+        path = os.path.join(tempfile.mkdtemp(), "handoff")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        listener.settimeout(util.HANDOFF_TIMEOUT)
+
+        argv = [arg for arg in sys.argv if not arg.startswith("--takeover=")]
+        subprocess.Popen([sys.executable] + argv + [f"--takeover={path}"])
+
+        try:
+            (conn, _) = listener.accept()
+        except socket.timeout:
+            HANDOFF.resume()
+            print("restart: new server did not start")
+            return
+        finally:
+            listener.close()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+        conn.settimeout(util.HANDOFF_TIMEOUT)
+
+        # Registry changes wait on presence_lock and channel_lock, presence
+        # updates on presence_send_lock and writes on the send locks. None
+        # is released again: this process is done.
+        self.presence_send_lock.acquire()
+        self.presence_lock.acquire()
+        self.channel_lock.acquire()
+
+        sessions = [session for session in self.client_list.values()
+                    if isinstance(session, Session)]
+        gateways = list(self.gateways)
+        joining = list(self.joining)
+        acquired = []
+
+        for session in sessions + [gateway.conn for gateway in gateways]:
+            if not session.send_lock.acquire(timeout=util.HANDOFF_TIMEOUT):
+                break
+            acquired.append(session)
+
+            # frames queued behind a writer that gave up the lock
+            try:
+                session.flush()
+            except OSError:
+                pass
+
+        if self.index is not None:
+            self.index.dump()
+
+        fds = [self.sock.fileno()] + \
+            [session.sock.fileno() for session in sessions] + \
+            [gateway.conn.sock.fileno() for gateway in gateways] + \
+            [session.sock.fileno() for session in joining]
+        snapshot = json.dumps({
+            "fds": len(fds),
+            "users": [session.username for session in sessions],
+            "gateways": [[gateway.name, gateway.sessions] for gateway in gateways],
+            "channels": {channel: sorted(members)
+                         for channel, members in self.channels.items()},
+            "presence_seq": self.presence_seq,
+            "presence_changes": self.presence_changes,
+            "presence_subscribers": sorted(self.presence_subscribers),
+        }).encode("utf-8")
+
+        try:
+            if len(acquired) < len(sessions) + len(gateways):
+                raise OSError("a connection is still being written to")
+
+            conn.sendall(util.pack_frame(snapshot))
+
+            for start in range(0, len(fds), util.SCM_MAX_FDS):
+                socket.send_fds(conn, [b"F"], fds[start:start+util.SCM_MAX_FDS])
+
+            if conn.recv(1) != b"K":
+                raise OSError("no acknowledgement")
+        except OSError:
+            # without the acknowledgement the new server may not own the
+            # sessions, so this one keeps going
+            print("restart: handoff failed")
+            for session in acquired:
+                session.send_lock.release()
+            self.channel_lock.release()
+            self.presence_lock.release()
+            self.presence_send_lock.release()
+            conn.close()
+            HANDOFF.resume()
+            return
+
+        print(f"restart: handed over {len(self.client_list)} users "
+              f"on {len(sessions) + len(gateways)} connections")
+
+        self.dump_trace()
+        if self.profiler:
+            self.profiler.stop()
+
+        sys.stdout.flush()
+        os._exit(0)
+
+    def take_over(self, path: str):
+        '''
+        Receives the listening socket, sessions and registry of the server
+        that is restarting, see restart
+        '''
+        import json
+
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(path)
+
+        (size,) = util.FRAME_HEADER.unpack(
+            util.recv_exactly(conn, util.FRAME_HEADER.size))
+        snapshot = json.loads(util.recv_exactly(conn, size))
+
+        if self.index is not None:
+            self.index.load()
+
+        fds = []
+        while len(fds) < snapshot["fds"]:
+            _, received, _, _ = socket.recv_fds(conn, 1, util.SCM_MAX_FDS)
+            fds.extend(received)
+
+        socks = [socket.socket(fileno=fd) for fd in fds]
+        for sock in socks:
+            sock.settimeout(None)
+
+        self.sock = socks[0]
+        users = len(snapshot["users"])
+
+        for channel, members in snapshot["channels"].items():
+            self.channels[channel] = set(members)
+            for username in members:
+                self.user_channels.setdefault(username, set()).add(channel)
+
+        for username, sock in zip(snapshot["users"], socks[1:1+users]):
+            self.client_list[username] = Session(sock, username)
+            self.num_connections += 1
+
+        gateways = []
+
+        for (name, sessions), sock in zip(snapshot["gateways"], socks[1+users:]):
+            gateway = Gateway(name, Session(sock, name))
+            gateway.sessions = sessions
+            gateways.append(gateway)
+
+            for session_id, username in sessions.items():
+                self.client_list[username] = LogicalSession(
+                    gateway, session_id, username)
+
+        with self.channel_lock:
+            for channel in self.channels:
+                self.refresh_channel(channel)
+
+        self.presence_seq = snapshot["presence_seq"]
+        self.presence_changes.update(snapshot["presence_changes"])
+        self.presence_subscribers = set(snapshot["presence_subscribers"])
+
+        # reading starts once every user is reachable, a message read
+        # before its recipient is registered would be dropped
+        for username in snapshot["users"]:
+            Thread(name="Handler", target=HANDOFF.run,
+                   args=(self.connection_handler, username), daemon=True).start()
+
+        for gateway in gateways:
+            self.start_gateway(gateway)
+
+        # connections that had not sent their join yet
+        for sock in socks[1+users+len(gateways):]:
+            self.admission.resume_handshake()
+            self.start_join(Session(sock))
+
+        conn.sendall(b"K")
+        conn.close()
+
+        print(f"restart: took over {len(self.client_list)} users")
 
     def shutdown(self):
         '''
@@ -192,6 +1621,14 @@ class Server:
         for username in list(self.client_list):
             print(f"disconnected: {username}")
 
+        self.dump_trace()
+
+        if self.profiler:
+            self.profiler.stop()
+
+        if self.index is not None:
+            self.index.dump()
+
         sys.exit()
 
 # Do not change this part of code
@@ -205,25 +1642,97 @@ if __name__ == "__main__":
         print("Server")
         print("-p PORT | --port=PORT The server port, defaults to 15000")
         print("-a ADDRESS | --address=ADDRESS The server ip or hostname, defaults to localhost")
+        print("-g TOKEN | --gateway-token=TOKEN Accept multiplexed gateway connections using TOKEN")
+        print("-t FILE | --trace=FILE Trace messages and write the records to FILE")
+        print("--profile=FILE Sample the stacks of all threads, toggled with SIGUSR2,")
+        print("               writes collapsed stacks for flame graphs to FILE")
+        print("--search=FILE Index relayed messages for the search command,")
+        print("              kept in FILE between runs")
+        print("--search-max=COUNT Messages the search index keeps, defaults to 1000000")
+        print("--search-bytes=BYTES Total text length the search index keeps,")
+        print("                     defaults to 268435456 (256 MiB)")
+        print("--search-age=SECONDS Evict indexed messages older than SECONDS")
+        print("--memory-limit=MIB Memory all receive buffers together may grow by,")
+        print("                   larger frames spill to temporary files, defaults to 64")
+        print("--backlog=COUNT Connections the kernel queues before they are accepted,")
+        print("                defaults to 128")
+        print("--join-timeout=SECONDS Time a new connection has to join, defaults to 5")
+        print("--join-rate=COUNT Joins accepted per second before new ones are refused")
+        print("                  with ERR_SERVER_BUSY, defaults to 100")
+        print("SIGHUP or the restart command hand all sessions over to a new server process")
         print("-h | --help Print this help")
 
     try:
         OPTS, ARGS = getopt.getopt(sys.argv[1:],
-                                   "p:a", ["port=", "address="])
+                                   "p:ag:t:", ["port=", "address=", "gateway-token=",
+                                               "trace=", "profile=", "search=",
+                                               "search-max=", "search-bytes=", "search-age=",
+                                               "memory-limit=",
+                                               "backlog=", "join-timeout=", "join-rate=",
+                                               "takeover="])
     except getopt.GetoptError:
         helper()
         exit()
 
     PORT = 15000
     DEST = "localhost"
+    GATEWAY_TOKEN = None
+    TRACER = None
+    PROFILER = None
+    INDEX_PATH = None
+    INDEX_MAX = util.SEARCH_MAX_MESSAGES
+    INDEX_BYTES = util.SEARCH_MAX_BYTES
+    INDEX_AGE = None
+    TAKEOVER = None
+    BACKLOG = util.LISTEN_BACKLOG
+    JOIN_TIMEOUT = util.JOIN_TIMEOUT
+    JOIN_RATE = util.JOIN_RATE
 
     for o, a in OPTS:
         if o in ("-p", "--port="):
             PORT = int(a)
         elif o in ("-a", "--address="):
             DEST = a
+        elif o in ("-g", "--gateway-token"):
+            GATEWAY_TOKEN = a
+        elif o in ("-t", "--trace"):
+            from tracing import Tracer
+            TRACER = Tracer(a)
+            signal.signal(signal.SIGUSR1, lambda signum, frame: TRACER.dump())
+        elif o == "--profile":
+            from profiler import SamplingProfiler
+            PROFILER = SamplingProfiler(a)
+        elif o == "--search":
+            INDEX_PATH = a
+        elif o == "--search-max":
+            INDEX_MAX = int(a)
+        elif o == "--search-bytes":
+            INDEX_BYTES = int(a)
+        elif o == "--search-age":
+            INDEX_AGE = float(a)
+        elif o == "--memory-limit":
+            MEMORY.limit = int(a) * 1024 * 1024
+        elif o == "--backlog":
+            BACKLOG = int(a)
+        elif o == "--join-timeout":
+            JOIN_TIMEOUT = float(a)
+        elif o == "--join-rate":
+            JOIN_RATE = float(a)
+        elif o == "--takeover":
+            TAKEOVER = a
+
+    INDEX = None
+    if INDEX_PATH:
+        from search import MessageIndex
+        INDEX = MessageIndex(INDEX_PATH, INDEX_MAX, INDEX_AGE, INDEX_BYTES)
+
+    ADMISSION = Admission(BACKLOG, JOIN_TIMEOUT, JOIN_RATE)
+    SERVER = Server(DEST, PORT, GATEWAY_TOKEN, TRACER, PROFILER, INDEX, TAKEOVER, ADMISSION)
+    signal.signal(signal.SIGHUP, lambda signum, frame: SERVER.restart())
 
-    SERVER = Server(DEST, PORT)
+    if PROFILER:
+        signal.signal(signal.SIGUSR2,
+                      lambda signum, frame: SERVER.toggle_profiler())
     try:
         SERVER.start()
     except (KeyboardInterrupt, SystemExit):
@@ -0,0 +1,151 @@
+'''
+Per-message tracing for the Chat Application.
+
+A traced message carries a trace id in its frame header (see util.py).
+Client and server record a monotonic timestamp for the id at every stage
+it passes, into a fixed size ring buffer. The buffer is written out as JSON
+lines on demand and at shutdown.
+
+Running this module combines the dumps of a server and its clients into
+per-stage latency histograms:
+    python3 tracing.py server.trace client1.trace client2.trace
+
+Timestamps come from time.monotonic_ns, which all processes on one Linux
+host share, so traces are only comparable between processes on one host.
+'''
+import itertools
+import json
+import os
+import sys
+import time
+
+
+# Stages in the order a message passes them
+STAGES = ["client_encode", "client_send", "server_recv", "server_parse",
+          "server_fanout", "server_send", "client_recv", "client_print"]
+
+# (from stage, to stage, both recorded by the same process)
+STAGE_PAIRS = [("client_encode", "client_send", True),
+               ("client_send", "server_recv", False),
+               ("server_recv", "server_parse", True),
+               ("server_parse", "server_fanout", True),
+               ("server_fanout", "server_send", True),
+               ("server_fanout", "client_recv", False),
+               ("client_recv", "client_print", True),
+               ("client_encode", "client_print", False)]
+
+
+class Tracer:
+    '''
+    Ring buffer of (trace id, stage, timestamp) records.
+    Recording is one counter increment and one list store; when the
+    buffer is full the oldest records are overwritten.
+    '''
+
+    def __init__(self, path, capacity=65536):
+        self.path = path
+        self.capacity = capacity
+        self.records = [None] * capacity
+        self.counter = itertools.count()
+
+    @staticmethod
+    def new_trace_id() -> int:
+        '''
+        Random non-zero 64 bit trace id
+        '''
+        return int.from_bytes(os.urandom(8), "big") or 1
+
+    def record(self, trace_id: int, stage: str):
+        '''
+        Records that the message trace_id reached stage now
+        '''
+        self.records[next(self.counter) % self.capacity] = (
+            trace_id, stage, time.monotonic_ns())
+
+    def dump(self):
+        '''
+        Appends the buffered records to the trace file and empties the buffer
+        '''
+        records, self.records = self.records, [None] * self.capacity
+        records = sorted(filter(None, records), key=lambda record: record[2])
+        pid = os.getpid()
+
+        with open(self.path, "a", encoding="UTF-8") as file:
+            for trace_id, stage, timestamp in records:
+                file.write(json.dumps(
+                    {"trace": trace_id, "stage": stage, "ns": timestamp, "pid": pid}) + "\n")
+
+
+def load(paths) -> dict:
+    '''
+    Reads trace files and groups their records by trace id
+    '''
+    traces = {}
+
+    for path in paths:
+        with open(path, encoding="UTF-8") as file:
+            for line in file:
+                record = json.loads(line)
+                traces.setdefault(record["trace"], []).append(record)
+
+    return traces
+
+
+def stage_latencies(traces) -> dict:
+    '''
+    Returns the latencies in ns of every STAGE_PAIRS entry.
+    Every record of the later stage is paired with the latest earlier-stage
+    record of the same message that precedes it.
+    '''
+    latencies = {(start, end): [] for start, end, _ in STAGE_PAIRS}
+
+    for records in traces.values():
+        for start, end, same_process in STAGE_PAIRS:
+            for record in records:
+                if record["stage"] != end:
+                    continue
+
+                previous = [other["ns"] for other in records
+                            if other["stage"] == start and other["ns"] <= record["ns"]
+                            and (not same_process or other["pid"] == record["pid"])]
+
+                if previous:
+                    latencies[(start, end)].append(record["ns"] - max(previous))
+
+    return latencies
+
+
+def print_histogram(name, values):
+    '''
+    Prints percentiles and a power of two histogram of latencies in ns
+    '''
+    if not values:
+        return
+
+    values = sorted(values)
+
+    def percentile(fraction):
+        return values[min(int(len(values) * fraction), len(values) - 1)] / 1000
+
+    print(f"{name}: {len(values)} samples, p50 {percentile(0.5):.1f} us, "
+          f"p90 {percentile(0.9):.1f} us, p99 {percentile(0.99):.1f} us, "
+          f"max {values[-1] / 1000:.1f} us")
+
+    buckets = {}
+    for value in values:
+        bucket = max(value // 1000, 1).bit_length()
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    for bucket in sorted(buckets):
+        label = f"< {2 ** bucket} us"
+        print(f"  {label:>12} {'#' * max(buckets[bucket] * 50 // len(values), 1)} "
+              f"{buckets[bucket]}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 tracing.py TRACE_FILE [TRACE_FILE ...]")
+        sys.exit(1)
+
+    for (START, END), VALUES in stage_latencies(load(sys.argv[1:])).items():
+        print_histogram(f"{START} -> {END}", VALUES)
@@ -1,8 +1,78 @@
 '''
 This file contains basic utility function that you can use.
 '''
+import socket
+import struct
 
 MAX_NUM_CLIENTS = 10
+MAX_SESSIONS_PER_GATEWAY = 1000
+PRESENCE_BATCH_WINDOW = 0.05  # seconds
+
+# Every message is sent as a frame: a 4 byte big-endian length followed by
+# the message. This keeps message boundaries intact when several messages
+# share a stream, e.g. the user sessions multiplexed over a gateway.
+FRAME_HEADER = struct.Struct("!I")
+
+# A traced frame has TRACE_FLAG set in its length and an 8 byte trace id
+# between the header and the message, see tracing.py
+TRACE_FLAG = 0x80000000
+TRACE_ID = struct.Struct("!Q")
+
+# struct timeval of socket timeouts such as SO_SNDTIMEO
+TIMEVAL = struct.Struct("@ll")
+
+# Initial size of the server's per-session receive buffer. Larger frames
+# grow it for one message only, so idle sessions stay small.
+RECV_BUFFER_SIZE = 512
+
+# Python heap held by the thread serving an idle connection, on top of its
+# session, as measured by Benchmarks/session_memory.py
+HANDLER_THREAD_MEMORY = 4096
+
+# Most buffers handed to a single sendmsg call
+IOV_MAX = 1024
+
+# Frames other threads may leave queued on a session that is being written
+# to, they go out with the current write. Past this, and for frames larger
+# than COALESCE_MAX_BYTES, they wait for it.
+COALESCE_MAX_FRAMES = 64
+COALESCE_MAX_BYTES = 4096
+
+# Only the first SPILL_THRESHOLD bytes of a frame are received into memory,
+# the rest goes to a temporary file in SPILL_CHUNK pieces. The receive
+# buffers of all sessions together grow by at most MEMORY_LIMIT bytes,
+# past it frames spill after RECV_BUFFER_SIZE bytes. A recipient that takes
+# none of a spilled frame for SPILL_SEND_TIMEOUT seconds is disconnected.
+SPILL_THRESHOLD = 256 * 1024
+SPILL_CHUNK = 64 * 1024
+MEMORY_LIMIT = 64 * 1024 * 1024
+SPILL_SEND_TIMEOUT = 10
+
+# Kernel socket buffers of bulk connections: gateways, and connections that
+# have carried a frame of at least BULK_FRAME_SIZE bytes (files)
+BULK_FRAME_SIZE = 64 * 1024
+SOCKET_BUFFER_SIZE = 1024 * 1024
+
+# Admission control: connections the kernel queues until they are accepted,
+# seconds a new connection has to send its whole join, the largest join
+# message, joins per second, and connections that may be joining at once.
+# Beyond the last two joins get ERR_SERVER_BUSY.
+LISTEN_BACKLOG = 128
+JOIN_TIMEOUT = 5
+MAX_JOIN_FRAME = RECV_BUFFER_SIZE
+JOIN_RATE = 100
+MAX_PENDING_JOINS = 64
+
+# Search index: messages and total length of their texts kept before the
+# oldest are evicted, and the results returned for one query
+SEARCH_MAX_MESSAGES = 1000000
+SEARCH_MAX_BYTES = 256 * 1024 * 1024
+SEARCH_RESULTS = 20
+
+# Graceful restarts: seconds to wait for the new server, and file
+# descriptors per SCM_RIGHTS message (the Linux limit is 253)
+HANDOFF_TIMEOUT = 10
+SCM_MAX_FDS = 250
 
 
 def make_message(msg_type, msg_format, message=None):
@@ -18,3 +88,52 @@ def make_message(msg_type, msg_format, message=None):
     if msg_format in [1, 3, 4]:
         return "%s %s" % (msg_type, message)
     return ""
+
+
+def pack_header(size, trace_id=0):
+    '''
+    Frame header for a message of size bytes
+    '''
+    if trace_id:
+        return FRAME_HEADER.pack(size | TRACE_FLAG) + TRACE_ID.pack(trace_id)
+    return FRAME_HEADER.pack(size)
+
+
+def pack_frame(data, trace_id=0):
+    '''
+    Prefixes the encoded message with its length
+    '''
+    return pack_header(len(data), trace_id) + data
+
+
+
+def tune_socket(sock, bulk=False):
+    '''
+    Turns off Nagle's algorithm, messages are written as whole frames and
+    should not wait for the ACK of the previous one. Bulk connections also
+    get SOCKET_BUFFER_SIZE send and receive buffers.
+    '''
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    if bulk:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+
+
+def recv_exactly(sock, size):
+    '''
+    Reads exactly size bytes from a blocking socket.
+    Returns b"" if the connection closes first.
+    '''
+    chunks = []
+
+    while size:
+        chunk = sock.recv(size)
+
+        if not chunk:
+            return b""
+
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)